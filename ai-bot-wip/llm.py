@@ -0,0 +1,151 @@
+import asyncio
+import json
+import logging
+import random
+from typing import AsyncIterator
+
+import aiohttp
+
+logger = logging.getLogger(__name__)
+
+RETRY_STATUSES = {408, 429, 500, 502, 503, 504, 529}
+MAX_BACKOFF = 30
+
+
+class LLMError(Exception):
+    """The messages API answered with an error we are not going to retry."""
+
+    def __init__(self, status: int, body: str) -> None:
+        super().__init__(f"LLM API returned {status}: {body[:200]}")
+        self.status = status
+
+
+class LLMClient:
+    """One pooled aiohttp session for the messages API, with timeouts and jittered retries."""
+
+    def __init__(
+        self,
+        base_url: str,
+        api_key: str,
+        model: str,
+        timeout: float,
+        connect_timeout: float,
+        max_attempts: int,
+    ) -> None:
+        self.base_url = base_url.rstrip("/")
+        self.api_key = api_key
+        self.model = model
+        self.timeout = aiohttp.ClientTimeout(total=timeout, sock_connect=connect_timeout)
+        self.max_attempts = max_attempts
+        self._session: aiohttp.ClientSession | None = None
+
+    async def start(self) -> None:
+        self._session = aiohttp.ClientSession(
+            headers={
+                "x-api-key": self.api_key,
+                "anthropic-version": "2023-06-01",
+                "Content-Type": "application/json",
+            },
+            timeout=self.timeout,
+            connector=aiohttp.TCPConnector(limit=8, keepalive_timeout=60),
+        )
+
+    async def close(self) -> None:
+        if self._session is not None:
+            await self._session.close()
+
+    def stream(self, prompt: str, max_tokens: int = 4096, system: str | None = None) -> "StreamedReply":
+        """Send a single user message and read the reply as it streams in, see StreamedReply."""
+        return StreamedReply(self, {**self._payload(prompt, max_tokens, system), "stream": True})
+
+    def _payload(self, prompt: str, max_tokens: int, system: str | None) -> dict:
+        payload = {
+            "model": self.model,
+            "max_tokens": max_tokens,
+            "messages": [{"role": "user", "content": prompt}],
+        }
+        if system is not None:
+            # A separate cacheable block: the provider reuses its prefix cache across requests
+            # for as long as the system text stays byte-identical
+            payload["system"] = [{"type": "text", "text": system, "cache_control": {"type": "ephemeral"}}]
+        return payload
+
+    async def _open(self, payload: dict) -> aiohttp.ClientResponse:
+        """POST to /messages until we get a successful response; the caller reads and releases it."""
+        backoff = 1.0
+        for attempt in range(1, self.max_attempts + 1):
+            try:
+                response = await self._session.post(f"{self.base_url}/messages", json=payload)
+                if response.status < 400:
+                    return response
+                async with response:
+                    body = await response.text()
+                if response.status not in RETRY_STATUSES or attempt == self.max_attempts:
+                    raise LLMError(response.status, body)
+                delay = _retry_after(response.headers.get("retry-after"))
+                if delay is not None:
+                    delay *= random.uniform(1.0, 1.2)
+                reason = f"HTTP {response.status}"
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+                if attempt == self.max_attempts:
+                    raise
+                delay = None
+                reason = e.__class__.__name__
+
+            if delay is None:
+                delay = min(backoff, MAX_BACKOFF) * random.uniform(0.5, 1.5)
+                backoff *= 2
+            logger.warning("LLM request failed (%s, attempt %d), retrying in %.1fs", reason, attempt, delay)
+            await asyncio.sleep(delay)
+
+
+class StreamedReply:
+    """One streamed reply: use as an async context manager, then iterate over its text deltas.
+
+    Retries only cover getting the stream started; leave the block early to abandon the
+    generation. stop_reason stays None unless the stream was read to the end.
+    """
+
+    def __init__(self, client: LLMClient, payload: dict) -> None:
+        self._client = client
+        self._payload = payload
+        self._response: aiohttp.ClientResponse | None = None
+        self.stop_reason: str | None = None
+
+    async def __aenter__(self) -> "StreamedReply":
+        self._response = await self._client._open(self._payload)
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        self._response.release()
+
+    async def __aiter__(self) -> AsyncIterator[str]:
+        async for line in self._response.content:
+            if not line.startswith(b"data:"):
+                continue
+            event = json.loads(line[5:])
+            if event["type"] == "message_start":
+                _log_usage(event["message"].get("usage", {}))
+            elif event["type"] == "content_block_delta" and event["delta"]["type"] == "text_delta":
+                yield event["delta"]["text"]
+            elif event["type"] == "message_delta":
+                self.stop_reason = event["delta"].get("stop_reason")
+                logger.info("LLM stream finished: %s, usage %s", self.stop_reason, event.get("usage"))
+            elif event["type"] == "error":
+                raise LLMError(self._response.status, json.dumps(event["error"]))
+
+
+def _log_usage(usage: dict) -> None:
+    logger.info(
+        "LLM input tokens: %s uncached, %s written to cache, %s read from cache",
+        usage.get("input_tokens"),
+        usage.get("cache_creation_input_tokens", 0),
+        usage.get("cache_read_input_tokens", 0),
+    )
+
+
+def _retry_after(value: str | None) -> float | None:
+    try:
+        return min(float(value), MAX_BACKOFF) if value is not None else None
+    except ValueError:
+        return None
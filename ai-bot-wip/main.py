@@ -2,14 +2,21 @@ import asyncio
 import logging
 import os
 import re
-from datetime import datetime
+from datetime import date
 from pathlib import Path
-from concurrent.futures import ThreadPoolExecutor
 
-import requests
-from telegram import Update
+from telegram import Message, Update
+from telegram.constants import ChatType
+from telegram.error import TelegramError
 from telegram.ext import Application, CommandHandler
 
+from llm import LLMClient
+from progress import ProgressMessage
+from result_cache import ResultCache
+from scheduler import Rejected, Scheduler
+from tokens import Grant, TokenError, verify_token_v1
+from watched_file import WatchedFile
+
 logging.basicConfig(
     format="%(asctime)s - %(name)s - %(levelname)s - %(message)s", level=logging.INFO
 )
@@ -22,15 +29,33 @@ TELEGRAM_ADMIN_IDS = {int(x) for x in os.environ["TELEGRAM_ADMIN_IDS"].split(","
 LLM_API_URL = os.environ["LLM_API_URL"]
 LLM_API_KEY = os.environ["LLM_API_KEY"]
 LLM_API_MODEL = os.environ.get("LLM_API_MODEL", "claude-3-5-sonnet-20241022")
+LLM_TIMEOUT = float(os.environ.get("LLM_TIMEOUT", "300"))
+LLM_CONNECT_TIMEOUT = float(os.environ.get("LLM_CONNECT_TIMEOUT", "10"))
+LLM_MAX_ATTEMPTS = int(os.environ.get("LLM_MAX_ATTEMPTS", "4"))
+PROGRESS_INTERVAL = float(os.environ.get("PROGRESS_INTERVAL", "3"))
+LLM_WORKERS = int(os.environ.get("LLM_WORKERS", "2"))
+QUEUE_SIZE = int(os.environ.get("QUEUE_SIZE", "20"))
+DEFAULT_PRIORITY = int(os.environ.get("DEFAULT_PRIORITY", "1"))
+DEFAULT_DAILY_MESSAGES = int(os.environ.get("DEFAULT_DAILY_MESSAGES", "20"))
+DEFAULT_MAX_TOKENS = int(os.environ.get("DEFAULT_MAX_TOKENS", "4096"))
+ADMIN_PRIORITY = int(os.environ.get("ADMIN_PRIORITY", "10"))
+BASE_PROMPT_CHECK_INTERVAL = float(os.environ.get("BASE_PROMPT_CHECK_INTERVAL", "5"))
+# Secret shared with harddver's sign_token_v1; without it /token is off and everyone gets the defaults
+TOKEN_SECRET = os.environ.get("TIGOR_XECUT_SECRET")
+TOKEN_AUTHORITIES = set(os.environ.get("TOKEN_AUTHORITIES", "xecut").split(","))
 URL_BASE = "https://xecut-ai-ugc.tgr.rs/"
 
 RESULTS_DIR = Path(__file__).parent / "results"
 BASE_PROMPT_PATH = Path(__file__).parent / "base_prompt.md"
+HTML_BLOCK = re.compile(r"```html\s*(.*?)\s*```", re.DOTALL)
 
 # Simple state
 ai_enabled = False
-task_queue = asyncio.Queue()
-is_processing = False
+scheduler = Scheduler(QUEUE_SIZE)
+grants: dict[int, Grant] = {}  # Telegram user id -> grant from the token they sent
+results = ResultCache(RESULTS_DIR, LLM_API_MODEL)
+base_prompt = WatchedFile(BASE_PROMPT_PATH, BASE_PROMPT_CHECK_INTERVAL)
+llm = LLMClient(LLM_API_URL, LLM_API_KEY, LLM_API_MODEL, LLM_TIMEOUT, LLM_CONNECT_TIMEOUT, LLM_MAX_ATTEMPTS)
 
 
 def is_correct_chat(update: Update) -> bool:
@@ -52,73 +77,98 @@ def is_admin(update: Update) -> bool:
     return msg.from_user.id in TELEGRAM_ADMIN_IDS
 
 
-def _call_api(prompt: str) -> str:
-    """Call LLM API synchronously."""
-    response = requests.post(
-        f"{LLM_API_URL}/messages",
-        headers={
-            "x-api-key": LLM_API_KEY,
-            "anthropic-version": "2023-06-01",
-            "Content-Type": "application/json",
-        },
-        json={
-            "model": LLM_API_MODEL,
-            "max_tokens": 4096,
-            "messages": [{"role": "user", "content": prompt}],
-        },
-        timeout=300,
-    )
-    response.raise_for_status()
-    data = response.json()
-    return data["content"][0]["text"]
-
-
-async def generate_html(prompt: str) -> tuple[str, str]:
-    """Generate HTML from prompt and save to file."""
-    base_prompt = BASE_PROMPT_PATH.read_text()
-    full_prompt = f"{base_prompt}\n\n# Task\n\n{prompt}"
-
-    # Run API call in thread pool
-    loop = asyncio.get_event_loop()
-    with ThreadPoolExecutor() as executor:
-        content = await loop.run_in_executor(executor, _call_api, full_prompt)
-
-    # Extract HTML from markdown code block
-    match = re.search(r"```html\s*(.*?)\s*```", content, re.DOTALL)
-    html = match.group(1) if match else content
-
-    # Save to file
-    timestamp = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
-    RESULTS_DIR.mkdir(exist_ok=True)
-    result_path = RESULTS_DIR / f"{timestamp}.html"
-    result_path.write_text(html)
-
-    return str(result_path), html
+def grant_for(user_id: int) -> Grant:
+    """What this Telegram user may do right now."""
+    if user_id in TELEGRAM_ADMIN_IDS:
+        return Grant(f"tg:{user_id}", ADMIN_PRIORITY, None, DEFAULT_MAX_TOKENS)
+    grant = grants.get(user_id)
+    if grant is not None and not grant.expired(date.today()):
+        return grant
+    return Grant(f"tg:{user_id}", DEFAULT_PRIORITY, DEFAULT_DAILY_MESSAGES, DEFAULT_MAX_TOKENS)
+
+
+async def generate_html(
+    prompt: str, system: str, progress: ProgressMessage, max_tokens: int
+) -> tuple[str, bool]:
+    """Stream HTML for the prompt, reporting progress; also tells whether the page came out whole."""
+    content = ""
+    match = None
+    async with llm.stream(f"# Task\n\n{prompt}", max_tokens, system=system) as reply:
+        async for chunk in reply:
+            content += chunk
+            # Stop as soon as the code block closes; anything after it is commentary we don't use
+            if "`" in chunk:
+                match = HTML_BLOCK.search(content)
+                if match:
+                    break
+            await progress.update(len(content))
+
+    if match and reply.stop_reason != "max_tokens":
+        return match.group(1), True
+    # No closing fence: the reply was cut off (e.g. by max_tokens) or came without a code block
+    logger.warning("Incomplete reply (stop reason %s)", reply.stop_reason)
+    return content.partition("```html")[2].strip() or content, False
+
+
+async def send_document(msg: Message, result_path: Path) -> None:
+    """Attach a generated page to a reply."""
+    with open(result_path, "rb") as document:
+        await msg.reply_document(document=document, filename=result_path.name)
+
+
+async def reply_when_ready(msg: Message, result: asyncio.Future[Path]) -> None:
+    """Answer a request that joined an identical generation already in progress."""
+    try:
+        result_path = await asyncio.shield(result)
+    except Exception:
+        await report_failure(msg, None)
+        return
+    try:
+        await msg.reply_text(f"ok\n{URL_BASE}{result_path.name}")
+        await send_document(msg, result_path)
+    except TelegramError as e:
+        logger.warning("Could not deliver %s: %s", result_path.name, e)
+
+
+async def report_failure(msg: Message, progress: ProgressMessage | None) -> None:
+    """Tell the user a generation failed, without letting Telegram errors take the worker down."""
+    try:
+        if progress is not None:
+            await progress.finish("error generating")
+        else:
+            await msg.reply_text("error generating")
+    except TelegramError as e:
+        logger.warning("Could not report failure: %s", e)
 
 
 async def process_queue():
-    """Process tasks from queue one at a time."""
-    global is_processing
+    """Take tasks from the scheduler one at a time; several of these run side by side."""
     while True:
-        update, prompt = await task_queue.get()
-        is_processing = True
+        task = await scheduler.get()
+        update, prompt, system, key = task.item
         msg = update.message
 
+        progress = None
         try:
-            result_path, html = await generate_html(prompt)
-            filename = Path(result_path).name
-            url = f"{URL_BASE}{filename}"
-
-            await msg.reply_text(f"ok\n{url}")
-            await msg.reply_document(document=open(result_path, "rb"), filename=filename)
-
-            logger.info("Task completed: %s", filename)
+            progress = ProgressMessage(await msg.reply_text("generating…"), PROGRESS_INTERVAL)
+            html, complete = await generate_html(prompt, system, progress, task.grant.max_tokens)
+            result_path = results.store(key, html, cache=complete)
         except Exception as e:
             logger.error("Task failed: %s", e, exc_info=True)
-            await msg.reply_text("error generating")
+            results.fail(key, e)
+            scheduler.refund(task.grant)
+            await report_failure(msg, progress)
+        else:
+            # The page exists from here on, so a Telegram hiccup is only a delivery problem
+            try:
+                await progress.finish(f"ok\n{URL_BASE}{result_path.name}")
+                await send_document(msg, result_path)
+                logger.info("Task completed: %s", result_path.name)
+            except TelegramError as e:
+                logger.warning("Generated %s but could not deliver it: %s", result_path.name, e)
         finally:
-            is_processing = False
-            task_queue.task_done()
+            results.fail(key, RuntimeError("generation abandoned"))
+            scheduler.done(task)
 
 
 async def handle_make(update: Update, _) -> None:
@@ -127,6 +177,8 @@ async def handle_make(update: Update, _) -> None:
         return
 
     msg = update.message
+    if msg.from_user is None:
+        return
 
     # Only admins can use /make when AI is disabled
     if not ai_enabled and not is_admin(update):
@@ -139,8 +191,63 @@ async def handle_make(update: Update, _) -> None:
         await msg.reply_text("Usage: /make <prompt>")
         return
 
-    await task_queue.put((update, prompt))
-    logger.info("Task queued: %s", prompt)
+    grant = grant_for(msg.from_user.id)
+    # Keep the base prompt the key was made with, in case the file changes while this waits
+    system = base_prompt.text
+    key = results.key(prompt, system, grant.max_tokens)
+    result_path = results.get(key)
+    if result_path is not None:
+        await msg.reply_text(f"ok\n{URL_BASE}{result_path.name}")
+        await send_document(msg, result_path)
+        logger.info("Cache hit %s: %s", key, prompt)
+        return
+    if key in results.inflight:
+        await msg.reply_text("Same prompt is already being generated, waiting for it")
+        asyncio.create_task(reply_when_ready(msg, results.inflight[key]))
+        logger.info("Joined in-flight generation %s: %s", key, prompt)
+        return
+
+    try:
+        ahead = scheduler.submit(grant, (update, prompt, system, key))
+    except Rejected as e:
+        await msg.reply_text(f"Not queued: {e}")
+        logger.info("Task rejected for %s: %s", grant.account, e)
+        return
+    results.begin(key)
+
+    if ahead or scheduler.running >= LLM_WORKERS:
+        await msg.reply_text(f"Queued, {ahead} ahead")
+    logger.info("Task queued for %s (priority %d): %s", grant.account, grant.priority, prompt)
+
+
+async def handle_token(update: Update, _) -> None:
+    """Accept a signed AI token in a private chat and apply its limits to the sender."""
+    msg = update.message
+    if msg is None or msg.from_user is None or msg.chat.type != ChatType.PRIVATE:
+        return
+    if TOKEN_SECRET is None:
+        await msg.reply_text("Tokens are not enabled")
+        return
+
+    try:
+        grant = verify_token_v1(
+            (msg.text or "")[7:],  # strip "/token "
+            TOKEN_SECRET,
+            TOKEN_AUTHORITIES,
+            date.today(),
+            account=f"tg:{msg.from_user.id}",
+        )
+    except TokenError as e:
+        await msg.reply_text(f"Bad token: {e}")
+        logger.info("Rejected token from %s: %s", msg.from_user.id, e)
+        return
+
+    grants[msg.from_user.id] = grant
+    await msg.reply_text(
+        f"Token accepted until {grant.valid_until}: priority {grant.priority}, "
+        f"{grant.max_daily_messages} prompts a day, up to {grant.max_tokens} tokens"
+    )
+    logger.info("User %s accepted token issued to %s", msg.from_user.id, grant.subject)
 
 
 async def handle_ai_on(update: Update, _) -> None:
@@ -209,15 +316,30 @@ async def handle_start(update: Update, _) -> None:
 
 
 async def post_init(app: Application) -> None:
-    """Start background queue processor."""
-    asyncio.create_task(process_queue())
+    """Open the LLM client and start the queue workers and base prompt watcher."""
+    await llm.start()
+    asyncio.create_task(base_prompt.watch())
+    for _ in range(LLM_WORKERS):
+        asyncio.create_task(process_queue())
+
+
+async def post_shutdown(app: Application) -> None:
+    """Close pooled LLM connections."""
+    await llm.close()
 
 
 def main() -> None:
-    app = Application.builder().token(TELEGRAM_API_KEY).post_init(post_init).build()
+    app = (
+        Application.builder()
+        .token(TELEGRAM_API_KEY)
+        .post_init(post_init)
+        .post_shutdown(post_shutdown)
+        .build()
+    )
 
     app.add_handler(CommandHandler("start", handle_start))
     app.add_handler(CommandHandler("make", handle_make))
+    app.add_handler(CommandHandler("token", handle_token))
     app.add_handler(CommandHandler("ai-on", handle_ai_on))
     app.add_handler(CommandHandler("ai-off", handle_ai_off))
     app.add_handler(CommandHandler("ai-clean", handle_ai_clean))
@@ -0,0 +1,59 @@
+import logging
+import time
+from datetime import timedelta
+
+from telegram import Message
+from telegram.error import BadRequest, RetryAfter, TelegramError
+
+logger = logging.getLogger(__name__)
+
+# Rough output token estimate; the API only reports exact usage once the stream ends
+CHARS_PER_TOKEN = 4
+
+
+class ProgressMessage:
+    """One status message edited in place while a generation streams in.
+
+    Telegram rate-limits edits per chat, so updates are throttled to one per interval and a
+    flood-wait simply pushes the next edit back instead of stalling the stream.
+    """
+
+    def __init__(self, message: Message, interval: float) -> None:
+        self.message = message
+        self.interval = interval
+        self.started = time.monotonic()
+        self._next_edit = self.started + interval
+        self._text = message.text
+
+    async def update(self, chars: int) -> None:
+        now = time.monotonic()
+        if now < self._next_edit:
+            return
+        self._next_edit = now + self.interval
+        await self._edit(f"generating… ~{chars // CHARS_PER_TOKEN} tokens, {now - self.started:.0f}s")
+
+    async def finish(self, text: str) -> None:
+        """Put the final text in the status message, or post it separately if the edit is refused."""
+        self._next_edit = float("inf")
+        if not await self._edit(text):
+            await self.message.reply_text(text)
+
+    async def _edit(self, text: str) -> bool:
+        if text == self._text:
+            return True
+        try:
+            await self.message.edit_text(text)
+        except RetryAfter as e:
+            wait = e.retry_after.total_seconds() if isinstance(e.retry_after, timedelta) else e.retry_after
+            self._next_edit = time.monotonic() + wait
+            logger.warning("Progress edit throttled for %ss", wait)
+            return False
+        except BadRequest as e:
+            if "not modified" not in e.message.lower():
+                logger.warning("Progress edit failed: %s", e)
+                return False
+        except TelegramError as e:
+            logger.warning("Progress edit failed: %s", e)
+            return False
+        self._text = text
+        return True
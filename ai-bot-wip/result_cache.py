@@ -0,0 +1,66 @@
+import asyncio
+import hashlib
+import os
+import time
+from pathlib import Path
+
+
+def normalize_prompt(prompt: str) -> str:
+    """Fold away differences that don't change what gets generated: case and whitespace."""
+    return " ".join(prompt.casefold().split())
+
+
+class ResultCache:
+    """Generated pages stored under a hash of everything that went into them.
+
+    The key covers the normalized prompt, the base prompt, the model and the output token
+    limit, so editing base_prompt.md or switching models naturally misses. Generations in
+    progress are tracked too, so an identical request waits for the running one instead of
+    starting its own.
+    """
+
+    def __init__(self, directory: Path, model: str) -> None:
+        self.directory = directory
+        self.model = model
+        self.inflight: dict[str, asyncio.Future[Path]] = {}
+
+    def key(self, prompt: str, base_prompt: str, max_tokens: int) -> str:
+        digest = hashlib.sha256()
+        for part in (self.model, str(max_tokens), base_prompt, normalize_prompt(prompt)):
+            digest.update(part.encode())
+            digest.update(b"\0")
+        return digest.hexdigest()[:24]
+
+    def path(self, key: str) -> Path:
+        return self.directory / f"{key}.html"
+
+    def get(self, key: str) -> Path | None:
+        path = self.path(key)
+        return path if path.exists() else None
+
+    def begin(self, key: str) -> None:
+        self.inflight[key] = asyncio.get_running_loop().create_future()
+
+    def store(self, key: str, html: str, cache: bool = True) -> Path:
+        """Write the page and wake up everyone waiting for it.
+
+        With cache=False (a cut-off or otherwise incomplete page) it still gets its own file to
+        link to, but not the key's name, so the next identical request generates afresh.
+        """
+        self.directory.mkdir(exist_ok=True)
+        path = self.path(key) if cache else self.directory / f"{key}-{time.time_ns()}.html"
+        # Write then rename, so a half-written file is never served as a hit
+        tmp = path.with_suffix(".tmp")
+        tmp.write_text(html)
+        os.replace(tmp, path)
+        future = self.inflight.pop(key, None)
+        if future is not None and not future.done():
+            future.set_result(path)
+        return path
+
+    def fail(self, key: str, error: BaseException) -> None:
+        future = self.inflight.pop(key, None)
+        if future is not None and not future.done():
+            future.set_exception(error)
+            # Nobody may be waiting; don't let asyncio complain about an unretrieved exception
+            future.exception()
@@ -0,0 +1,90 @@
+import asyncio
+import heapq
+import itertools
+from dataclasses import dataclass, field
+from datetime import date
+from typing import Any
+
+from tokens import Grant
+
+
+class Rejected(Exception):
+    """The task was not queued: the queue is full or the user is out of quota."""
+
+
+@dataclass(order=True)
+class Task:
+    finish: float
+    seq: int
+    grant: Grant = field(compare=False)
+    item: Any = field(compare=False)
+
+
+class Scheduler:
+    """Bounded queue shared by the workers, with weighted fair queuing between accounts.
+
+    Each task gets a virtual finish time of start + 1/priority, where start is the later of the
+    current virtual time and the account's previous finish. Serving tasks in finish order gives
+    every account with something queued a share of the workers proportional to its priority,
+    so one user queuing ten prompts doesn't push everyone else back by ten generations.
+    """
+
+    def __init__(self, max_size: int) -> None:
+        self.max_size = max_size
+        self.running = 0
+        self._heap: list[Task] = []
+        self._seq = itertools.count()
+        self._available = asyncio.Semaphore(0)
+        self._virtual = 0.0
+        self._last_finish: dict[str, float] = {}
+        self._day = date.today()
+        self._used: dict[str, int] = {}
+
+    def __len__(self) -> int:
+        return len(self._heap)
+
+    def used(self, account: str) -> int:
+        self._roll_day()
+        return self._used.get(account, 0)
+
+    def submit(self, grant: Grant, item: Any) -> int:
+        """Queue an item and count it against the daily quota; returns how many tasks are ahead of it."""
+        if len(self._heap) >= self.max_size:
+            raise Rejected("queue is full, try again later")
+        if grant.max_daily_messages is not None and self.used(grant.account) >= grant.max_daily_messages:
+            raise Rejected(f"daily limit of {grant.max_daily_messages} reached")
+
+        if not self._heap:
+            # Nothing is waiting, so nobody is behind anyone: start everyone from the same point
+            self._last_finish.clear()
+        start = max(self._virtual, self._last_finish.get(grant.account, 0.0))
+        task = Task(start + 1 / grant.priority, next(self._seq), grant, item)
+        self._last_finish[grant.account] = task.finish
+        self._used[grant.account] = self._used.get(grant.account, 0) + 1
+        heapq.heappush(self._heap, task)
+        self._available.release()
+        return sum(1 for other in self._heap if other < task)
+
+    async def get(self) -> Task:
+        await self._available.acquire()
+        task = heapq.heappop(self._heap)
+        self._virtual = max(self._virtual, task.finish - 1 / task.grant.priority)
+        # Accounts whose last finish is behind the virtual clock would start from it anyway
+        self._last_finish = {k: v for k, v in self._last_finish.items() if v > self._virtual}
+        self.running += 1
+        return task
+
+    def done(self, task: Task) -> None:
+        self.running -= 1
+
+    def refund(self, grant: Grant) -> None:
+        """Give back a quota unit for a task that failed through no fault of the user."""
+        self._roll_day()
+        if self._used.get(grant.account):
+            self._used[grant.account] -= 1
+
+    def _roll_day(self) -> None:
+        today = date.today()
+        if today != self._day:
+            self._day = today
+            self._used.clear()
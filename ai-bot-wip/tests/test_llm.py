@@ -0,0 +1,99 @@
+import asyncio
+import json
+import logging
+
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+from llm import LLMClient, LLMError
+
+
+def sse(*events: dict) -> bytes:
+    return b"".join(f"event: {event['type']}\ndata: {json.dumps(event)}\n\n".encode() for event in events)
+
+
+async def run_stub(handler, body):
+    """Serve handler as the messages endpoint and run body(client) against it."""
+    app = web.Application()
+    app.router.add_post("/v1/messages", handler)
+    server = TestServer(app)
+    await server.start_server()
+    client = LLMClient(str(server.make_url("/v1")), "test-key", "test-model", 10, 2, 3)
+    await client.start()
+    try:
+        return await body(client)
+    finally:
+        await client.close()
+        await server.close()
+
+
+def test_stream_sends_cacheable_system_block_and_logs_cache_usage(caplog):
+    requests = []
+    usage = [
+        {"input_tokens": 12, "cache_creation_input_tokens": 1300, "cache_read_input_tokens": 0},
+        {"input_tokens": 12, "cache_creation_input_tokens": 0, "cache_read_input_tokens": 1300},
+    ]
+
+    async def messages(request):
+        requests.append((request.headers, await request.json()))
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        await response.prepare(request)
+        await response.write(
+            sse(
+                {"type": "message_start", "message": {"usage": usage[len(requests) - 1]}},
+                {"type": "content_block_delta", "index": 0, "delta": {"type": "text_delta", "text": "Hello, "}},
+                {"type": "content_block_delta", "index": 0, "delta": {"type": "text_delta", "text": "world"}},
+                {"type": "message_delta", "delta": {"stop_reason": "end_turn"}, "usage": {"output_tokens": 3}},
+                {"type": "message_stop"},
+            )
+        )
+        return response
+
+    async def body(client):
+        texts = []
+        for _ in usage:
+            async with client.stream("# Task\n\nhi", 1024, system="BASE") as reply:
+                texts.append("".join([chunk async for chunk in reply]))
+                assert reply.stop_reason == "end_turn"
+        return texts
+
+    with caplog.at_level(logging.INFO, logger="llm"):
+        texts = asyncio.run(run_stub(messages, body))
+
+    assert texts == ["Hello, world", "Hello, world"]
+    headers, payload = requests[0]
+    assert headers["x-api-key"] == "test-key"
+    assert payload["stream"] is True
+    assert payload["max_tokens"] == 1024
+    assert payload["system"] == [{"type": "text", "text": "BASE", "cache_control": {"type": "ephemeral"}}]
+    assert payload["messages"] == [{"role": "user", "content": "# Task\n\nhi"}]
+    logged = [r.getMessage() for r in caplog.records if "input tokens" in r.getMessage()]
+    assert logged == [
+        "LLM input tokens: 12 uncached, 1300 written to cache, 0 read from cache",
+        "LLM input tokens: 12 uncached, 0 written to cache, 1300 read from cache",
+    ]
+
+
+def test_stream_retries_before_first_byte_then_gives_up_on_client_errors():
+    statuses = [429, 503, 200, 400]
+
+    async def messages(request):
+        status = statuses.pop(0)
+        if status != 200:
+            return web.Response(status=status, headers={"retry-after": "0"}, text="nope")
+        response = web.StreamResponse()
+        await response.prepare(request)
+        await response.write(sse({"type": "content_block_delta", "delta": {"type": "text_delta", "text": "ok"}}))
+        return response
+
+    async def body(client):
+        async with client.stream("hi") as reply:
+            text = "".join([chunk async for chunk in reply])
+        try:
+            async with client.stream("hi"):
+                pass
+        except LLMError as e:
+            return text, e.status
+        return text, None
+
+    assert asyncio.run(run_stub(messages, body)) == ("ok", 400)
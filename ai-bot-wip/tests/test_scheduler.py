@@ -0,0 +1,116 @@
+import asyncio
+
+import pytest
+
+from scheduler import Rejected, Scheduler
+from tokens import Grant
+
+
+def grant(account: str, priority: int = 1, daily: int | None = None) -> Grant:
+    return Grant(account, priority, daily, 4096)
+
+
+async def drain(scheduler: Scheduler) -> list:
+    order = []
+    while len(scheduler):
+        task = await scheduler.get()
+        order.append(task.item)
+        scheduler.done(task)
+    return order
+
+
+def test_equal_priorities_interleave_instead_of_first_come_first_served():
+    async def run():
+        scheduler = Scheduler(10)
+        for i in range(3):
+            scheduler.submit(grant("a"), f"a{i}")
+        scheduler.submit(grant("b"), "b0")
+        return await drain(scheduler)
+
+    assert asyncio.run(run()) == ["a0", "b0", "a1", "a2"]
+
+
+def test_higher_priority_gets_proportionally_more_turns():
+    async def run():
+        scheduler = Scheduler(20)
+        for i in range(4):
+            scheduler.submit(grant("low"), f"low{i}")
+        for i in range(6):
+            scheduler.submit(grant("high", priority=2), f"high{i}")
+        return await drain(scheduler)
+
+    # Two high-priority turns for every low-priority one while both have work queued;
+    # on equal finish tags the earlier submission goes first
+    assert asyncio.run(run()) == [
+        "high0", "low0", "high1", "high2", "low1", "high3", "high4", "low2", "high5", "low3",
+    ]
+
+
+def test_newcomer_is_not_penalised_for_past_usage():
+    async def run():
+        scheduler = Scheduler(10)
+        for i in range(3):
+            scheduler.submit(grant("a"), f"a{i}")
+        await drain(scheduler)
+        scheduler.submit(grant("a"), "a3")
+        scheduler.submit(grant("b"), "b0")
+        return await drain(scheduler)
+
+    assert asyncio.run(run()) == ["a3", "b0"]
+
+
+def test_submit_reports_tasks_ahead():
+    async def run():
+        scheduler = Scheduler(10)
+        return [
+            scheduler.submit(grant("a"), "a0"),
+            scheduler.submit(grant("a"), "a1"),
+            scheduler.submit(grant("b"), "b0"),
+        ]
+
+    assert asyncio.run(run()) == [0, 1, 1]
+
+
+def test_full_queue_rejects():
+    async def run():
+        scheduler = Scheduler(2)
+        scheduler.submit(grant("a"), 1)
+        scheduler.submit(grant("b"), 2)
+        with pytest.raises(Rejected, match="full"):
+            scheduler.submit(grant("c"), 3)
+        task = await scheduler.get()
+        scheduler.done(task)
+        scheduler.submit(grant("c"), 3)
+
+    asyncio.run(run())
+
+
+def test_daily_quota_counts_submissions_and_refunds():
+    async def run():
+        scheduler = Scheduler(10)
+        limited = grant("a", daily=2)
+        scheduler.submit(limited, 1)
+        scheduler.submit(limited, 2)
+        with pytest.raises(Rejected, match="daily limit of 2"):
+            scheduler.submit(limited, 3)
+        scheduler.refund(limited)
+        scheduler.submit(limited, 3)
+        assert scheduler.used("a") == 2
+        # Unlimited grants are counted but never rejected
+        for i in range(5):
+            scheduler.submit(grant("admin"), i)
+        assert scheduler.used("admin") == 5
+
+    asyncio.run(run())
+
+
+def test_quota_resets_on_a_new_day():
+    async def run():
+        scheduler = Scheduler(10)
+        limited = grant("a", daily=1)
+        scheduler.submit(limited, 1)
+        scheduler._day = scheduler._day.replace(year=scheduler._day.year - 1)
+        scheduler.submit(limited, 2)
+        assert scheduler.used("a") == 1
+
+    asyncio.run(run())
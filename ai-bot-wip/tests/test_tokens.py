@@ -0,0 +1,79 @@
+import base64
+import hashlib
+import hmac
+from datetime import date
+
+import pytest
+
+from tokens import SMS_PREFIX, TokenError, verify_token_v1
+
+SECRET = "door-secret"
+TODAY = date(2026, 3, 10)
+
+
+def sign(
+    user_id="xecut_0", priority=3, max_daily_messages=5, max_tokens=2048, valid_until="2026-03-17",
+    authority="xecut", version="v1", secret=SECRET,
+) -> str:
+    """Same layout as harddver's sign_token_v1, with the expiry date under our control."""
+    fields = (user_id, priority, max_daily_messages, max_tokens, valid_until, version, authority)
+    message = "|".join(str(value) for value in fields)
+    signature = base64.urlsafe_b64encode(hmac.new(secret.encode(), message.encode(), hashlib.sha256).digest()).decode()
+    return f"{message}|{signature}"
+
+
+def verify(token: str, today: date = TODAY):
+    return verify_token_v1(token, SECRET, {"xecut"}, today, account="tg:42")
+
+
+def test_valid_token_gives_its_limits_to_the_telegram_account():
+    grant = verify(sign())
+    assert grant.account == "tg:42"
+    assert grant.subject == "xecut:xecut_0"
+    assert (grant.priority, grant.max_daily_messages, grant.max_tokens) == (3, 5, 2048)
+    assert grant.valid_until == date(2026, 3, 17)
+
+
+def test_accepts_the_door_qr_link_and_surrounding_whitespace():
+    assert verify(f"  {SMS_PREFIX}{sign()}\n").max_tokens == 2048
+
+
+def test_last_valid_day_is_inclusive():
+    assert verify(sign(), today=date(2026, 3, 17))
+    with pytest.raises(TokenError, match="expired"):
+        verify(sign(), today=date(2026, 3, 18))
+
+
+@pytest.mark.parametrize(
+    "token",
+    [
+        sign(secret="other-secret"),
+        sign().replace("|3|", "|9|", 1),
+        sign().replace("2026-03-17", "2027-03-17"),
+        sign()[:-4] + "AAA=",
+    ],
+    ids=["wrong-secret", "raised-priority", "extended-expiry", "mangled-signature"],
+)
+def test_forged_or_tampered_tokens_are_rejected(token):
+    with pytest.raises(TokenError, match="bad signature"):
+        verify(token)
+
+
+def test_untrusted_authority_is_rejected_even_with_valid_signature():
+    with pytest.raises(TokenError, match="unknown authority"):
+        verify(sign(authority="elsewhere"))
+
+
+@pytest.mark.parametrize("token", ["", "garbage", sign(version="v2"), sign() + "|extra"])
+def test_malformed_tokens_are_rejected(token):
+    with pytest.raises(TokenError, match="not a v1 token"):
+        verify(token)
+
+
+def test_signed_but_unparseable_fields_are_rejected():
+    with pytest.raises(TokenError, match="bad field"):
+        verify(sign(max_tokens="lots"))
+
+
+def test_priority_is_at_least_one():
+    assert verify(sign(priority=0)).priority == 1
@@ -0,0 +1,66 @@
+import base64
+import hashlib
+import hmac
+from dataclasses import dataclass
+from datetime import date
+
+# What the door QR code encodes around the token, see harddver/src/aitoken.py
+SMS_PREFIX = "sms:tigor_ai_token&body="
+
+
+class TokenError(Exception):
+    """The token is malformed, forged, expired or from an authority we don't trust."""
+
+
+@dataclass(frozen=True)
+class Grant:
+    """Who is asking and what they are allowed: from a signed token or the bot's defaults.
+
+    account is what quotas and fair queuing count against; subject is who a token was issued to.
+    """
+
+    account: str
+    priority: int
+    max_daily_messages: int | None
+    max_tokens: int
+    valid_until: date | None = None
+    subject: str | None = None
+
+    def expired(self, today: date) -> bool:
+        return self.valid_until is not None and today > self.valid_until
+
+
+def verify_token_v1(token: str, secret: str, authorities: set[str], today: date, account: str) -> Grant:
+    """Check a token made by `sign_token_v1` and turn it into a Grant for `account`.
+
+    Format: `user_id|priority|max_daily_messages|max_tokens|valid_until|v1|authority|signature`.
+    Only the limits are taken from the token. The door QR codes are all issued to the same
+    user_id, so counting against it would make every holder share one quota.
+    """
+    token = token.strip().removeprefix(SMS_PREFIX)
+    parts = token.split("|")
+    if len(parts) != 8 or parts[5] != "v1":
+        raise TokenError("not a v1 token")
+
+    message, signature = "|".join(parts[:7]), parts[7]
+    expected = base64.urlsafe_b64encode(hmac.new(secret.encode(), message.encode(), hashlib.sha256).digest()).decode()
+    if not hmac.compare_digest(signature.encode(), expected.encode()):
+        raise TokenError("bad signature")
+
+    user_id, priority, max_daily_messages, max_tokens, valid_until, _, authority = parts[:7]
+    if authority not in authorities:
+        raise TokenError(f"unknown authority {authority!r}")
+    try:
+        grant = Grant(
+            account=account,
+            priority=max(int(priority), 1),
+            max_daily_messages=int(max_daily_messages),
+            max_tokens=int(max_tokens),
+            valid_until=date.fromisoformat(valid_until),
+            subject=f"{authority}:{user_id}",
+        )
+    except ValueError as e:
+        raise TokenError(f"bad field: {e}") from e
+    if grant.expired(today):
+        raise TokenError(f"expired on {grant.valid_until}")
+    return grant
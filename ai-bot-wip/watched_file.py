@@ -0,0 +1,37 @@
+import asyncio
+import logging
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+
+class WatchedFile:
+    """A text file kept in memory and reloaded when its modification time changes."""
+
+    def __init__(self, path: Path, interval: float) -> None:
+        self.path = path
+        self.interval = interval
+        self.text = path.read_text()
+        self._mtime = path.stat().st_mtime_ns
+
+    def reload_if_changed(self) -> bool:
+        try:
+            mtime = self.path.stat().st_mtime_ns
+            if mtime == self._mtime:
+                return False
+            text = self.path.read_text()
+        except OSError as e:
+            # Editors may replace the file in several steps; keep the last good copy meanwhile
+            logger.warning("Could not reload %s: %s", self.path, e)
+            return False
+        self._mtime = mtime
+        if text == self.text:
+            return False
+        self.text = text
+        logger.info("Reloaded %s", self.path)
+        return True
+
+    async def watch(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            self.reload_if_changed()
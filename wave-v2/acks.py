@@ -0,0 +1,77 @@
+import logging
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+
+from metrics import DISPLAY_FAILURES, DISPLAY_SECONDS
+from tracing import Trace
+
+logger = logging.getLogger(__name__)
+
+MAX_TRACKED = 64
+
+
+@dataclass
+class PendingDisplay:
+    event: dict
+    origin: float
+    pushed: float
+    retries: int = 0
+    received: bool = False
+    loaded: bool = False
+    failed: bool = False
+    trace: Trace | None = None
+
+
+class DisplayTracker:
+    """Matches client render acks to pushed media messages and records how long they took to show."""
+
+    def __init__(self) -> None:
+        self._pending: OrderedDict[int, PendingDisplay] = OrderedDict()
+        self.last_loaded: dict | None = None
+
+    def track(self, event: dict, origin: float, retries: int = 0, trace: Trace | None = None) -> None:
+        if trace is not None:
+            trace.hold()
+        self._pending[event["seq"]] = PendingDisplay(event, origin, time.time(), retries, trace=trace)
+        while len(self._pending) > MAX_TRACKED:
+            self._pending.popitem(last=False)
+
+    def ack(self, seq: int, kind: str) -> PendingDisplay | None:
+        """Record an ack; returns the display when it failed for the first time and needs handling."""
+        pending = self._pending.get(seq)
+        if pending is None:
+            return None
+        media_type = pending.event["message"]["type"]
+        now = time.time()
+
+        if kind == "received" and not pending.received:
+            pending.received = True
+            DISPLAY_SECONDS.observe(now - pending.pushed, type=media_type, stage="received")
+            if pending.trace is not None:
+                pending.trace.event("ack_received", seq=seq)
+        elif kind == "loaded" and not pending.loaded:
+            pending.loaded = True
+            self.last_loaded = pending.event
+            DISPLAY_SECONDS.observe(now - pending.pushed, type=media_type, stage="loaded")
+            # A full-size upgrade of a preview already counted towards telegram_to_screen
+            stage = "upgraded" if pending.event["message"].get("upgrade") else "telegram_to_screen"
+            DISPLAY_SECONDS.observe(now - pending.origin, type=media_type, stage=stage)
+            logger.info(
+                "Media #%d (%s) on screen %.2fs after push, %.1fs after Telegram",
+                seq,
+                media_type,
+                now - pending.pushed,
+                now - pending.origin,
+            )
+            if pending.trace is not None:
+                pending.trace.event("ack_loaded", seq=seq)
+                pending.trace.release(outcome="shown")
+        elif kind == "failed" and not pending.failed and not pending.loaded:
+            pending.failed = True
+            DISPLAY_FAILURES.inc(type=media_type)
+            logger.warning("Media #%d (%s) failed to load on a viewer", seq, media_type)
+            if pending.trace is not None:
+                pending.trace.event("ack_failed", seq=seq)
+            return pending
+        return None
@@ -0,0 +1,123 @@
+import asyncio
+import itertools
+import logging
+import time
+
+import aiohttp
+from aiohttp import web
+
+logger = logging.getLogger(__name__)
+
+BOT_USER = {"id": 1, "is_bot": True, "first_name": "HardWave Bench", "username": "hardwave_bench_bot"}
+
+
+class FakeBotApi:
+    """Just enough of the Telegram Bot API for wave-v2: updates, getFile, reactions and file downloads."""
+
+    def __init__(self, file_size: int) -> None:
+        self.file_size = file_size
+        self.updates: asyncio.Queue[dict] = asyncio.Queue()
+        self.delivered: dict[str, float] = {}
+        self.calls: dict[str, int] = {}
+        self.downloads = 0
+        self.webhook_url: str | None = None
+        self.webhook_secret = ""
+        self._update_ids = itertools.count(1)
+        self._message_ids = itertools.count(1)
+        self._pusher: asyncio.Task | None = None
+
+    def app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post("/bot{token}/{method}", self._method)
+        app.router.add_get("/file/bot{token}/{path:.+}", self._file)
+        return app
+
+    def add_media(
+        self,
+        chat_id: int,
+        user_id: int,
+        file_unique_id: str,
+        media_group_id: str | None = None,
+        topic_id: int | None = None,
+    ) -> None:
+        message = {
+            "message_id": next(self._message_ids),
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "supergroup", "title": "bench"},
+            "from": {"id": user_id, "is_bot": False, "first_name": f"user{user_id}", "username": f"user{user_id}"},
+            "photo": [
+                {"file_id": f"small_{file_unique_id}", "file_unique_id": f"{file_unique_id}s", "width": 320, "height": 240},
+                {"file_id": f"file_{file_unique_id}", "file_unique_id": file_unique_id, "width": 1280, "height": 960},
+            ],
+        }
+        if media_group_id is not None:
+            message["media_group_id"] = media_group_id
+        if topic_id is not None:
+            message["chat"]["is_forum"] = True
+            message["message_thread_id"] = topic_id
+            message["is_topic_message"] = True
+        self.updates.put_nowait({"update_id": next(self._update_ids), "message": message})
+
+    def _mark_delivered(self, update: dict) -> None:
+        photo = update["message"]["photo"]
+        for size in photo:
+            self.delivered.setdefault(size["file_unique_id"], time.perf_counter())
+
+    async def _method(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"]
+        self.calls[method] = self.calls.get(method, 0) + 1
+        if request.content_type == "application/json":
+            params = await request.json()
+        else:
+            params = dict(await request.post())
+
+        if method == "getMe":
+            result = BOT_USER
+        elif method == "getUpdates":
+            result = await self._get_updates(float(params.get("timeout", 0)))
+        elif method == "getFile":
+            file_id = params["file_id"]
+            result = {"file_id": file_id, "file_unique_id": file_id, "file_path": f"photos/{file_id}.jpg"}
+        elif method == "setWebhook":
+            self.webhook_url = params["url"]
+            self.webhook_secret = params.get("secret_token", "")
+            self._pusher = asyncio.create_task(self._push_webhook())
+            result = True
+        else:
+            # setMessageReaction, sendMessage, deleteWebhook and friends just succeed
+            result = True
+        return web.json_response({"ok": True, "result": result})
+
+    async def _get_updates(self, timeout: float) -> list[dict]:
+        try:
+            first = await asyncio.wait_for(self.updates.get(), timeout)
+        except asyncio.TimeoutError:
+            return []
+        batch = [first]
+        while not self.updates.empty() and len(batch) < 100:
+            batch.append(self.updates.get_nowait())
+        for update in batch:
+            self._mark_delivered(update)
+        return batch
+
+    async def _push_webhook(self) -> None:
+        headers = {"X-Telegram-Bot-Api-Secret-Token": self.webhook_secret}
+        async with aiohttp.ClientSession() as session:
+            while True:
+                update = await self.updates.get()
+                self._mark_delivered(update)
+                try:
+                    async with session.post(self.webhook_url, json=update, headers=headers) as response:
+                        if response.status != 200:
+                            logger.warning("Webhook answered %s", response.status)
+                except aiohttp.ClientError as e:
+                    logger.warning("Webhook POST failed: %s", e)
+
+    async def _file(self, request: web.Request) -> web.Response:
+        self.downloads += 1
+        # A JPEG header so content sniffing does not trip, padded to the configured size
+        return web.Response(body=b"\xff\xd8\xff\xe0" + b"\0" * max(0, self.file_size - 4), content_type="image/jpeg")
+
+    async def close(self) -> None:
+        if self._pusher is not None:
+            self._pusher.cancel()
@@ -0,0 +1,291 @@
+"""Offline load test for wave-v2.
+
+Starts a fake Telegram Bot API, runs main.py against it as a separate process, connects
+simulated kiosks to /ws and replays a stream of media updates. Example:
+
+    python bench/run.py --updates 500 --rate 50 --viewers 10 --unthrottled
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import socket
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import aiohttp
+from aiohttp import web
+
+from fake_bot_api import FakeBotApi
+
+logger = logging.getLogger("bench")
+
+WAVE_DIR = Path(__file__).resolve().parent.parent
+CHAT_ID = -100
+API_KEY = "bench"
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def percentile(values: list[float], q: float) -> float:
+    if not values:
+        return float("nan")
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def media_id(file_unique_id: str) -> str:
+    # FakeBotApi gives a photo's preview size the media's id plus "s"
+    return file_unique_id.rstrip("s")
+
+
+def throughput(seen: list[dict[str, float]], started: float) -> float:
+    """Distinct media per second per viewer, from the first update to the last media to arrive."""
+    rates = []
+    for times in seen:
+        media = {media_id(uid) for uid in times}
+        if media:
+            rates.append(len(media) / (max(times.values()) - started))
+    return sum(rates) / len(rates) if rates else 0.0
+
+
+def read_memory(pid: int) -> dict[str, int]:
+    memory = {}
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                key, _, value = line.partition(":")
+                if key in ("VmRSS", "VmHWM"):
+                    memory[key] = int(value.split()[0])
+    except OSError:
+        pass
+    return memory
+
+
+class Kiosk:
+    def __init__(self, index: int, base_url: str, fetch_media: bool) -> None:
+        self.index = index
+        self.base_url = base_url
+        self.fetch_media = fetch_media
+        self.received: dict[str, float] = {}
+        self.loaded: dict[str, float] = {}
+        self.frames = 0
+        self.last_frame = time.perf_counter()
+
+    async def run(self, session: aiohttp.ClientSession) -> None:
+        async with session.ws_connect(f"{self.base_url}/ws?api_key={API_KEY}") as ws:
+            async for frame in ws:
+                if frame.type != aiohttp.WSMsgType.TEXT:
+                    continue
+                self.frames += 1
+                self.last_frame = time.perf_counter()
+                data = json.loads(frame.data)
+                message = data.get("message")
+                if not message or not message.get("url"):
+                    continue
+                file_unique_id = message["url"].split("?")[0].rsplit("/", 1)[-1]
+                self.received.setdefault(file_unique_id, self.last_frame)
+                await ws.send_json({"ack": "received", "seq": data["seq"]})
+                if self.fetch_media:
+                    asyncio.create_task(self._load(session, ws, message["url"], file_unique_id, data["seq"]))
+
+    async def _load(self, session, ws, url: str, file_unique_id: str, seq: int) -> None:
+        try:
+            async with session.get(self.base_url + url) as response:
+                await response.read()
+                ok = response.status == 200
+        except aiohttp.ClientError:
+            ok = False
+        if ok:
+            self.loaded.setdefault(file_unique_id, time.perf_counter())
+        if not ws.closed:
+            await ws.send_json({"ack": "loaded" if ok else "failed", "seq": seq})
+
+
+async def wait_for_server(url: str, timeout: float) -> None:
+    deadline = time.monotonic() + timeout
+    async with aiohttp.ClientSession() as session:
+        while True:
+            try:
+                async with session.get(url) as response:
+                    if response.status < 500:
+                        return
+            except aiohttp.ClientError:
+                pass
+            if time.monotonic() > deadline:
+                raise RuntimeError("wave-v2 did not start in time")
+            await asyncio.sleep(0.05)
+
+
+async def produce(api: FakeBotApi, args: argparse.Namespace) -> float:
+    started = time.perf_counter()
+    group = None
+    for i in range(args.updates):
+        if group is None and random.random() < args.albums:
+            group = f"album{i}"
+            group_left = random.randint(2, 10)
+        api.add_media(CHAT_ID, 1000 + random.randrange(args.users), f"media{i:06d}", group)
+        if group is not None:
+            group_left -= 1
+            if group_left == 0:
+                group = None
+        # Pace against the start time so a slow loop does not drift the offered rate
+        delay = started + (i + 1) / args.rate - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+    return time.perf_counter() - started
+
+
+async def bench(args: argparse.Namespace) -> dict:
+    api = FakeBotApi(args.file_size)
+    api_port, wave_port = free_port(), free_port()
+    api_runner = web.AppRunner(api.app(), access_log=None)
+    await api_runner.setup()
+    await web.TCPSite(api_runner, "127.0.0.1", api_port).start()
+
+    tmp = tempfile.TemporaryDirectory(prefix="hardwave-bench-")
+    env = {
+        **os.environ,
+        "TELEGRAM_API_KEY": "1:bench",
+        "HARDWAVE_API_KEY": API_KEY,
+        "ALLOWED_CHAT_IDS": str(CHAT_ID),
+        "ADMIN_IDS": "1",
+        "TELEGRAM_API_BASE_URL": f"http://127.0.0.1:{api_port}",
+        "WEBSOCKET_PORT": str(wave_port),
+        "MEDIA_CACHE_DIR": f"{tmp.name}/media",
+        "STATE_DIR": f"{tmp.name}/state",
+        # The playlist's on-screen dwell would otherwise dominate every latency and drop the backlog
+        "MIN_DWELL": str(args.min_dwell),
+        "PLAYLIST_SIZE": str(args.playlist_size or args.updates),
+    }
+    if args.unthrottled:
+        env.update(USER_RATE_PER_MIN="1000000", USER_BURST="1000000", GLOBAL_RATE_PER_MIN="1000000", GLOBAL_BURST="1000000")
+    if args.webhook:
+        env.update(WEBHOOK_URL=f"http://127.0.0.1:{wave_port}/telegram", WEBHOOK_SECRET="bench")
+
+    log_path = Path(tmp.name) / "server.log"
+    with log_path.open("w") as log:
+        server = await asyncio.create_subprocess_exec(
+            sys.executable, str(WAVE_DIR / "main.py"), env=env, cwd=WAVE_DIR, stdout=log, stderr=log
+        )
+    base_url = f"http://127.0.0.1:{wave_port}"
+    peak_rss = 0
+    try:
+        await wait_for_server(f"{base_url}/metrics", timeout=30)
+        while not api.calls.get("getUpdates") and not api.calls.get("setWebhook"):
+            await asyncio.sleep(0.05)
+
+        session = aiohttp.ClientSession()
+        kiosks = [Kiosk(i, base_url, not args.no_fetch) for i in range(args.viewers)]
+        kiosk_tasks = [asyncio.create_task(kiosk.run(session)) for kiosk in kiosks]
+        await asyncio.sleep(0.5)
+
+        async def sample_memory() -> None:
+            nonlocal peak_rss
+            while True:
+                peak_rss = max(peak_rss, read_memory(server.pid).get("VmRSS", 0))
+                await asyncio.sleep(0.25)
+
+        sampler = asyncio.create_task(sample_memory())
+        produce_started = time.perf_counter()
+        produce_seconds = await produce(api, args)
+
+        # Let the pipeline drain: stop once every kiosk has been quiet for longer than an item stays up
+        settle = max(args.settle, args.min_dwell + 2)
+        while time.perf_counter() - max(k.last_frame for k in kiosks) < settle:
+            await asyncio.sleep(0.1)
+
+        sampler.cancel()
+        memory = read_memory(server.pid)
+        async with session.get(f"{base_url}/metrics") as response:
+            metrics_text = await response.text()
+        for task in kiosk_tasks:
+            task.cancel()
+        await session.close()
+    finally:
+        if server.returncode is None:
+            server.terminate()
+            await server.wait()
+        await api.close()
+        await api_runner.cleanup()
+
+    ws_latencies = [
+        received - api.delivered[uid]
+        for kiosk in kiosks
+        for uid, received in kiosk.received.items()
+        if uid in api.delivered
+    ]
+    load_latencies = [
+        loaded - api.delivered[uid] for kiosk in kiosks for uid, loaded in kiosk.loaded.items() if uid in api.delivered
+    ]
+    dropped = {}
+    for line in metrics_text.splitlines():
+        if line.startswith("hardwave_events_dropped_total{"):
+            reason = line.split('"')[1]
+            dropped[reason] = float(line.rsplit(" ", 1)[1])
+
+    report = {
+        "updates": args.updates,
+        "offered_rate": args.updates / produce_seconds,
+        "viewers": args.viewers,
+        "mode": "webhook" if args.webhook else "polling",
+        "min_dwell_s": args.min_dwell,
+        "shown_per_viewer": sum(len({media_id(uid) for uid in k.received}) for k in kiosks) / max(1, len(kiosks)),
+        "ws_items_per_s": throughput([k.received for k in kiosks], produce_started),
+        "loaded_items_per_s": throughput([k.loaded for k in kiosks], produce_started),
+        "ws_frames": sum(k.frames for k in kiosks),
+        "update_to_ws_p50_ms": percentile(ws_latencies, 0.5) * 1000,
+        "update_to_ws_p99_ms": percentile(ws_latencies, 0.99) * 1000,
+        "update_to_loaded_p50_ms": percentile(load_latencies, 0.5) * 1000,
+        "update_to_loaded_p99_ms": percentile(load_latencies, 0.99) * 1000,
+        "bot_api_calls": api.calls,
+        "file_downloads": api.downloads,
+        "dropped": dropped,
+        "server_rss_kb": memory.get("VmRSS"),
+        "server_peak_rss_kb": max(peak_rss, memory.get("VmHWM", 0)),
+    }
+    if args.keep_log:
+        print(log_path.read_text(), file=sys.stderr)
+    tmp.cleanup()
+    return report
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--updates", type=int, default=200, help="media updates to replay")
+    parser.add_argument("--rate", type=float, default=20, help="updates per second")
+    parser.add_argument("--users", type=int, default=20, help="distinct senders")
+    parser.add_argument("--albums", type=float, default=0.0, help="probability an update starts an album")
+    parser.add_argument("--viewers", type=int, default=1, help="simulated kiosks on /ws")
+    parser.add_argument("--file-size", type=int, default=200_000, help="bytes per fake media file")
+    parser.add_argument("--min-dwell", type=float, default=0.0, help="MIN_DWELL for the server, seconds per item")
+    parser.add_argument("--playlist-size", type=int, default=0, help="PLAYLIST_SIZE for the server (0: --updates)")
+    parser.add_argument(
+        "--settle", type=float, default=2.0, help="seconds of silence that end the run (at least --min-dwell + 2)"
+    )
+    parser.add_argument("--no-fetch", action="store_true", help="kiosks do not download media")
+    parser.add_argument("--unthrottled", action="store_true", help="lift wave-v2 rate limits")
+    parser.add_argument("--webhook", action="store_true", help="deliver updates by webhook instead of polling")
+    parser.add_argument("--keep-log", action="store_true", help="print the server log to stderr")
+    parser.add_argument("--json", action="store_true", help="print the report as JSON")
+    args = parser.parse_args()
+
+    logging.basicConfig(format="%(asctime)s - %(name)s - %(levelname)s - %(message)s", level=logging.WARNING)
+    report = asyncio.run(bench(args))
+    if args.json:
+        print(json.dumps(report, indent=2))
+        return
+    for key, value in report.items():
+        print(f"{key:>26}: {value:.1f}" if isinstance(value, float) else f"{key:>26}: {value}")
+
+
+if __name__ == "__main__":
+    main()
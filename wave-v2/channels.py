@@ -0,0 +1,94 @@
+import asyncio
+from dataclasses import dataclass
+from pathlib import Path
+
+from telegram import Message
+
+from acks import DisplayTracker
+from dedup import RecentMedia
+from event_log import EventLog
+from history import MediaHistory
+from playlist import Playlist
+from state_store import StateStore
+from viewers import Viewer
+
+DEFAULT_CHANNEL = "default"
+
+
+@dataclass(frozen=True)
+class Source:
+    chat_id: int
+    topic_id: int | None = None
+
+    def matches(self, msg: Message) -> bool:
+        if msg.chat_id != self.chat_id:
+            return False
+        if self.topic_id is None:
+            return True
+        # Messages in a forum's General topic carry no thread id
+        return bool(msg.is_topic_message) and msg.message_thread_id == self.topic_id
+
+
+def parse_sources(spec: str) -> list[Source]:
+    """Parse `chat_id[/topic_id],...`, e.g. `-1001234567890/42,-1009876543210`."""
+    sources = []
+    for part in spec.split(","):
+        chat_id, _, topic_id = part.strip().partition("/")
+        sources.append(Source(int(chat_id), int(topic_id) if topic_id else None))
+    return sources
+
+
+def parse_channels(spec: str) -> dict[str, list[Source]]:
+    """Parse `name=sources;name=sources`, e.g. `hall=-1001234567890;kitchen=-1001234567890/42`."""
+    channels = {}
+    for part in spec.split(";"):
+        if not part.strip():
+            continue
+        name, separator, sources = part.partition("=")
+        name = name.strip()
+        if not separator or not name.replace("-", "").replace("_", "").isalnum():
+            raise ValueError(f"Bad display definition: {part!r}")
+        channels[name] = parse_sources(sources)
+    if not channels:
+        raise ValueError("No displays defined")
+    return channels
+
+
+class Channel:
+    """One named screen: the chats and topics it shows, what is on it now, and who is watching."""
+
+    def __init__(
+        self,
+        name: str,
+        sources: list[Source],
+        directory: Path,
+        event_log_size: int,
+        history_size: int,
+        playlist_size: int,
+        recent: RecentMedia,
+    ) -> None:
+        self.name = name
+        self.sources = sources
+        self.enabled = True
+        self.current_message: dict | None = None
+        # The media whose full size should replace the preview on screen once it is downloaded
+        self.upgrade_for: str | None = None
+        self.shown_at = 0.0
+        self.viewers: set[Viewer] = set()
+        self.ws_lock = asyncio.Lock()
+        self.event_log = EventLog(event_log_size)
+        self.store = StateStore(directory)
+        self.history = MediaHistory(directory / "history.jsonl", history_size)
+        self.displays = DisplayTracker()
+        self.playlist = Playlist(playlist_size)
+        self.recent = recent
+
+    def matches(self, msg: Message) -> bool:
+        return any(source.matches(msg) for source in self.sources)
+
+    def load(self) -> None:
+        saved = self.store.load()
+        self.enabled = saved.get("enabled", True)
+        if saved.get("current_message"):
+            self.current_message = self.event_log.append({"message": saved["current_message"]})
+        self.history.load()
@@ -0,0 +1,56 @@
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+
+
+@dataclass
+class RecentItem:
+    seen: float
+    phash: int | None = None
+
+
+class RecentMedia:
+    """Bounded index of media shown lately, by file_unique_id and optionally by perceptual hash.
+
+    Telegram keeps file_unique_id across forwards and re-sends of the same file, which catches
+    most reposts; the hash catches the same picture saved and uploaded again.
+    """
+
+    def __init__(self, window: float, size: int, max_distance: int) -> None:
+        self.window = window
+        self.size = size
+        self.max_distance = max_distance
+        self._items: OrderedDict[str, RecentItem] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def duplicate_of(self, file_unique_id: str, phash: int | None = None) -> str | None:
+        """The recent media this one repeats, if any."""
+        self._expire()
+        if file_unique_id in self._items:
+            return file_unique_id
+        if phash is None:
+            return None
+        for key, item in self._items.items():
+            if item.phash is not None and (item.phash ^ phash).bit_count() <= self.max_distance:
+                return key
+        return None
+
+    def add(self, file_unique_id: str, phash: int | None = None) -> None:
+        self._items.pop(file_unique_id, None)
+        self._items[file_unique_id] = RecentItem(time.monotonic(), phash)
+        while len(self._items) > self.size:
+            self._items.popitem(last=False)
+
+    def forget(self, file_unique_id: str) -> None:
+        """Let the media be posted again, e.g. because it was dropped before it got on screen."""
+        self._items.pop(file_unique_id, None)
+
+    def _expire(self) -> None:
+        deadline = time.monotonic() - self.window
+        while self._items:
+            item = next(iter(self._items.values()))
+            if item.seen > deadline:
+                break
+            self._items.popitem(last=False)
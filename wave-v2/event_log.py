@@ -0,0 +1,37 @@
+import secrets
+from collections import deque
+
+
+class EventLog:
+    """Ring buffer of outbound WebSocket events, numbered so viewers can resume after a reconnect."""
+
+    def __init__(self, size: int) -> None:
+        self.epoch = secrets.token_hex(4)
+        self.seq = 0
+        self._events: deque[dict] = deque(maxlen=size)
+
+    def append(self, data: dict) -> dict:
+        self.seq += 1
+        data["seq"] = self.seq
+        data["epoch"] = self.epoch
+        self._events.append(data)
+        return data
+
+    def marker(self) -> dict:
+        return {"current": True, "seq": self.seq, "epoch": self.epoch}
+
+    def since(self, epoch: str, seq: int) -> list[dict] | None:
+        """Events a viewer missed after `seq`, or None when it has to take a full snapshot.
+
+        Only the newest message survives in the delta: older ones were already replaced on screen.
+        """
+        if epoch != self.epoch or seq > self.seq:
+            return None
+        if seq == self.seq:
+            return []
+        if not self._events or seq < self._events[0]["seq"] - 1:
+            return None
+
+        missed = [event for event in self._events if event["seq"] > seq]
+        last_message = max((i for i, event in enumerate(missed) if "message" in event), default=None)
+        return [event for i, event in enumerate(missed) if "message" not in event or i == last_message]
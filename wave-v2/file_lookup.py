@@ -0,0 +1,53 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable
+
+logger = logging.getLogger(__name__)
+
+MAX_ENTRIES = 1024
+
+
+class FileLookupCache:
+    """TTL cache for getFile results with single-flight lookups and a cap on concurrent requests."""
+
+    def __init__(self, ttl: float, max_concurrent: int) -> None:
+        self.ttl = ttl
+        self._entries: OrderedDict[str, tuple[float, str]] = OrderedDict()
+        self._pending: dict[str, asyncio.Task] = {}
+        self._semaphore = asyncio.Semaphore(max_concurrent)
+
+    async def get(self, key: str, resolve: Callable[[], Awaitable[str]]) -> str:
+        hit = self._entries.get(key)
+        if hit is not None:
+            expires, url = hit
+            if expires > time.monotonic():
+                self._entries.move_to_end(key)
+                return url
+            del self._entries[key]
+
+        task = self._pending.get(key)
+        if task is None:
+            task = asyncio.create_task(self._resolve(key, resolve))
+            self._pending[key] = task
+            task.add_done_callback(lambda _: self._pending.pop(key, None))
+        else:
+            logger.debug("Joining in-flight getFile for %s", key)
+        return await asyncio.shield(task)
+
+    def expires(self, key: str) -> float | None:
+        """When the cached URL for key stops being trusted, on the time.monotonic() clock."""
+        hit = self._entries.get(key)
+        return hit[0] if hit is not None else None
+
+    def forget(self, key: str) -> None:
+        self._entries.pop(key, None)
+
+    async def _resolve(self, key: str, resolve: Callable[[], Awaitable[str]]) -> str:
+        async with self._semaphore:
+            url = await resolve()
+        self._entries[key] = (time.monotonic() + self.ttl, url)
+        while len(self._entries) > MAX_ENTRIES:
+            self._entries.popitem(last=False)
+        return url
@@ -0,0 +1,116 @@
+import json
+import logging
+import os
+import random
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import Callable
+
+logger = logging.getLogger(__name__)
+
+RANDOM_CACHED_ATTEMPTS = 8
+
+
+@dataclass
+class HistoryItem:
+    file_unique_id: str
+    file_id: str
+    type: str
+    sender: str
+    timestamp: float
+    preview_file_id: str | None = None
+    preview_file_unique_id: str | None = None
+
+
+class MediaHistory:
+    """Bounded ring of recently shown media, appended to a JSON-lines file so it survives restarts."""
+
+    def __init__(self, path: Path | None, size: int) -> None:
+        self.path = path
+        self.size = size
+        self._items: list[HistoryItem] = []
+        self._positions: dict[str, int] = {}
+        self._preview_positions: dict[str, int] = {}
+        self._next = 0
+        self._log_lines = 0
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def load(self) -> None:
+        if self.path is None or not self.path.exists():
+            return
+        with self.path.open() as f:
+            for line in f:
+                try:
+                    self._insert(HistoryItem(**json.loads(line)))
+                except (ValueError, TypeError) as e:
+                    logger.warning("Skipping bad history line: %s", e)
+                self._log_lines += 1
+        logger.info("Loaded %d media history item(s) from %s", len(self._items), self.path)
+        if self._log_lines > 2 * self.size:
+            self._compact()
+
+    def add(self, item: HistoryItem) -> None:
+        self._insert(item)
+        if self.path is None:
+            return
+        try:
+            with self.path.open("a") as f:
+                f.write(json.dumps(asdict(item), ensure_ascii=False) + "\n")
+            self._log_lines += 1
+            if self._log_lines > 2 * self.size:
+                self._compact()
+        except OSError as e:
+            logger.warning("Failed to persist media history: %s", e)
+
+    def get(self, file_unique_id: str) -> HistoryItem | None:
+        position = self._positions.get(file_unique_id)
+        return self._items[position] if position is not None else None
+
+    def file_id(self, file_unique_id: str) -> str | None:
+        """file_id to download this media again, whether it is an item's main file or its preview."""
+        position = self._positions.get(file_unique_id)
+        if position is not None:
+            return self._items[position].file_id
+        position = self._preview_positions.get(file_unique_id)
+        return self._items[position].preview_file_id if position is not None else None
+
+    def pick(self, prefer: Callable[[str], bool] | None = None) -> HistoryItem | None:
+        if not self._items:
+            return None
+        if prefer is not None:
+            for _ in range(RANDOM_CACHED_ATTEMPTS):
+                item = random.choice(self._items)
+                if prefer(item.file_unique_id):
+                    return item
+        return random.choice(self._items)
+
+    def _insert(self, item: HistoryItem) -> None:
+        position = self._positions.get(item.file_unique_id)
+        if position is not None:
+            self._preview_positions.pop(self._items[position].preview_file_unique_id, None)
+            self._items[position] = item
+        elif len(self._items) < self.size:
+            position = len(self._items)
+            self._items.append(item)
+            self._next = (position + 1) % self.size
+        else:
+            position = self._next
+            old = self._items[position]
+            del self._positions[old.file_unique_id]
+            self._preview_positions.pop(old.preview_file_unique_id, None)
+            self._items[position] = item
+            self._next = (position + 1) % self.size
+        self._positions[item.file_unique_id] = position
+        if item.preview_file_unique_id is not None:
+            self._preview_positions[item.preview_file_unique_id] = position
+
+    def _compact(self) -> None:
+        ordered = self._items[self._next:] + self._items[: self._next]
+        tmp_path = self.path.with_name(self.path.name + ".tmp")
+        with tmp_path.open("w") as f:
+            for item in ordered:
+                f.write(json.dumps(asdict(item), ensure_ascii=False) + "\n")
+        os.replace(tmp_path, self.path)
+        self._log_lines = len(ordered)
@@ -1,16 +1,42 @@
 import asyncio
+import functools
 import hmac
+import json
 import logging
 import os
 import re
-from dataclasses import dataclass
+import shutil
+import signal
+import socket
+import time
+from typing import Callable
 from pathlib import Path
+from urllib.parse import urlsplit
 
 import aiohttp
 from aiohttp import web
 from telegram import Update, Message
+from telegram.error import TelegramError
 from telegram.ext import Application, MessageHandler, CommandHandler, filters
 
+from acks import PendingDisplay
+from channels import DEFAULT_CHANNEL, Channel, parse_channels
+from dedup import RecentMedia
+from file_lookup import FileLookupCache
+from history import HistoryItem
+import metrics
+from media_cache import MediaCache
+from metrics import EVENTS_DROPPED, GETFILE_ERRORS, GETFILE_SECONDS, HANDLER_SECONDS, Gauge, timed
+from outbox import Outbox
+from photo_sizes import best_size, preview_size
+from playlist import PlaylistEntry
+from static_assets import StaticAssets
+from throttle import Throttle
+import tracing
+from tracing import Tracer
+from transcode import Transcoder
+from viewers import Viewer, describe
+
 logging.basicConfig(
     format="%(asctime)s - %(name)s - %(levelname)s - %(message)s", level=logging.INFO
 )
@@ -19,63 +45,398 @@ logger = logging.getLogger(__name__)
 
 TELEGRAM_API_KEY = os.environ["TELEGRAM_API_KEY"]
 HARDWAVE_API_KEY = os.environ["HARDWAVE_API_KEY"]
-ALLOWED_CHAT_IDS = {int(x) for x in os.environ["ALLOWED_CHAT_IDS"].split(",")}
+# DISPLAYS="hall=-1001234567890;kitchen=-1001234567890/42" routes chats and forum topics to named screens
+CHANNEL_SOURCES = parse_channels(os.environ.get("DISPLAYS") or f"{DEFAULT_CHANNEL}={os.environ['ALLOWED_CHAT_IDS']}")
 ADMIN_IDS = {int(x) for x in os.environ["ADMIN_IDS"].split(",")}
-WEBSOCKET_PORT = 8765
+WEBSOCKET_PORT = int(os.environ.get("WEBSOCKET_PORT", "8765"))
+TELEGRAM_API_BASE_URL = os.environ.get("TELEGRAM_API_BASE_URL", "https://api.telegram.org").rstrip("/")
+WEBHOOK_URL = os.environ.get("WEBHOOK_URL")
+WEBHOOK_SECRET = os.environ.get("WEBHOOK_SECRET", "")
+MEDIA_CACHE_DIR = Path(os.environ.get("MEDIA_CACHE_DIR", "/tmp/hardwave-media"))
+MEDIA_CACHE_MAX_BYTES = int(os.environ.get("MEDIA_CACHE_MAX_MB", "128")) * 1024 * 1024
+WS_QUEUE_SIZE = int(os.environ.get("WS_QUEUE_SIZE", "16"))
+WS_EVENT_LOG_SIZE = int(os.environ.get("WS_EVENT_LOG_SIZE", "256"))
+GETFILE_TTL = 50 * 60  # Telegram keeps a file_path valid for at least an hour
+GETFILE_CONCURRENCY = int(os.environ.get("GETFILE_CONCURRENCY", "4"))
+STATE_DIR = Path(os.environ.get("STATE_DIR", "/tmp/hardwave-state"))
+DROP_PENDING_UPDATES = os.environ.get("DROP_PENDING_UPDATES", "0") == "1"
+HISTORY_SIZE = int(os.environ.get("HISTORY_SIZE", "500"))
+USER_RATE_PER_MIN = float(os.environ.get("USER_RATE_PER_MIN", "6"))
+USER_BURST = int(os.environ.get("USER_BURST", "3"))
+GLOBAL_RATE_PER_MIN = float(os.environ.get("GLOBAL_RATE_PER_MIN", "30"))
+GLOBAL_BURST = int(os.environ.get("GLOBAL_BURST", "5"))
+OUTBOX_SIZE = 64
+REACTION_MAX_AGE = 60  # A reaction that could not be sent within a minute is no longer useful
+DISPLAY_RETRIES = 1  # Re-push a media message this many times before falling back to the last good one
+PLAYLIST_SIZE = int(os.environ.get("PLAYLIST_SIZE", "10"))
+MIN_DWELL = float(os.environ.get("MIN_DWELL", "5"))
+MAX_DWELL = float(os.environ.get("MAX_DWELL", "0"))  # 0 keeps the last media up until something new arrives
+TRACE_SAMPLE_RATE = float(os.environ.get("TRACE_SAMPLE_RATE", "0.05"))
+TRACE_FILE = os.environ.get("TRACE_FILE")
+TRACE_KEEP = 200
+TRACE_TIMEOUT = 120  # Give up waiting for acks and reactions after this long and write the trace as incomplete
+DEDUP_WINDOW = float(os.environ.get("DEDUP_WINDOW", "3600"))  # 0 shows reposts again
+DEDUP_SIZE = 1000
+PHASH = os.environ.get("PHASH", "0") == "1"
+PHASH_DISTANCE = int(os.environ.get("PHASH_DISTANCE", "6"))  # Bits of 64 that may differ on the same picture
+TRANSCODE = os.environ.get("TRANSCODE", "0") == "1"
+TRANSCODE_WORKERS = int(os.environ.get("TRANSCODE_WORKERS", "1"))
+# The panel is rotated left (see configuration.nix), so it is taller than wide
+PANEL_WIDTH, PANEL_HEIGHT = (int(x) for x in os.environ.get("PANEL_SIZE", "1080x1920").split("x"))
+
+RESTART_RECONNECT_MS = int(os.environ.get("RESTART_RECONNECT_MS", "1000"))
+DRAIN_TIMEOUT = 5  # Seconds to let viewers and the outbox catch up before exiting
+PREVIEW_MIN_SIDE = 320  # Telegram's "m" photo size and video thumbnails are about this big
 
 DISPLAY_TEXT_PATTERN = re.compile(r"^[a-zA-Z0-9\-_ ]{5,}$")
 
+if WEBHOOK_URL and not WEBHOOK_SECRET:
+    raise RuntimeError("WEBHOOK_SECRET is required when WEBHOOK_URL is set")
+
+TG_APP = web.AppKey("tg_app", Application)
+
+
+channels = {
+    name: Channel(
+        name,
+        sources,
+        STATE_DIR if name == DEFAULT_CHANNEL else STATE_DIR / name,
+        WS_EVENT_LOG_SIZE,
+        HISTORY_SIZE,
+        PLAYLIST_SIZE,
+        RecentMedia(DEDUP_WINDOW, DEDUP_SIZE, PHASH_DISTANCE),
+    )
+    for name, sources in CHANNEL_SOURCES.items()
+}
+media_cache = MediaCache(MEDIA_CACHE_DIR, MEDIA_CACHE_MAX_BYTES, GETFILE_TTL)
+file_lookups = FileLookupCache(GETFILE_TTL, GETFILE_CONCURRENCY)
+static_assets = StaticAssets(Path(__file__).parent)
+outbox = Outbox(OUTBOX_SIZE, REACTION_MAX_AGE)
+throttle = Throttle(USER_RATE_PER_MIN / 60, USER_BURST, GLOBAL_RATE_PER_MIN / 60, GLOBAL_BURST)
+# Transcoding and perceptual hashing share one process pool
+transcoder = Transcoder(PANEL_WIDTH, PANEL_HEIGHT, TRANSCODE_WORKERS) if TRANSCODE or PHASH else None
+tracer = Tracer(Path(TRACE_FILE) if TRACE_FILE else None, TRACE_SAMPLE_RATE, TRACE_KEEP, TRACE_TIMEOUT)
+
+Gauge("hardwave_ws_viewers", "Connected WebSocket viewers", lambda: sum(len(c.viewers) for c in channels.values()))
+Gauge("hardwave_media_cache_bytes", "Bytes held in the local media cache", lambda: media_cache.total_bytes)
+Gauge(
+    "hardwave_playlist_queued",
+    "Media waiting for its turn on screen",
+    lambda: sum(len(c.playlist) for c in channels.values()),
+)
+Gauge("hardwave_outbox_queued", "Reactions and replies waiting to be sent", lambda: outbox.queue.qsize())
+
+
+def route(msg: Message) -> list[Channel]:
+    """Enabled displays that should show this message; empty when it is not allowed anywhere."""
+    with tracing.span("route") as span:
+        span["channels"] = []
+        if msg is None:
+            logger.debug("Rejected: message is None")
+            return []
+        matched = [channel for channel in channels.values() if channel.matches(msg)]
+        if not matched:
+            logger.debug("Rejected: chat %s topic %s is not routed to a display", msg.chat_id, msg.message_thread_id)
+            return []
+        if not msg.from_user.username:
+            logger.debug("Rejected: user %s has no username", msg.from_user.id)
+            return []
+        enabled = [channel for channel in matched if channel.enabled]
+        if not enabled:
+            logger.debug("Rejected: display(s) %s are disabled", ", ".join(c.name for c in matched))
+        span["channels"] = [channel.name for channel in enabled]
+        return enabled
+
+
+def admin_channels(msg: Message) -> list[Channel]:
+    """Displays an admin command applies to: those fed by the chat it came from, or all of them."""
+    matched = [channel for channel in channels.values() if channel.matches(msg)]
+    return matched or list(channels.values())
+
+
+def react(msg: Message, emoji: str = "👍") -> None:
+    outbox.submit("reaction", tracing.bind("react", lambda: msg.set_reaction(emoji)))
+
 
-@dataclass
-class BotState:
-    enabled: bool = True
-    current_message: dict | None = None
-    ws_connection: web.WebSocketResponse | None = None
-    ws_lock: asyncio.Lock = None
+def once(callback: Callable[[], None]) -> Callable[[], None]:
+    """A message shown on several displays still gets one reaction."""
+    called = False
 
-    def __post_init__(self):
-        self.ws_lock = asyncio.Lock()
+    def wrapper() -> None:
+        nonlocal called
+        if not called:
+            called = True
+            callback()
 
+    return wrapper
 
-state = BotState()
 
+def reply(msg: Message, text: str) -> None:
+    outbox.submit("reply", lambda: msg.reply_text(text))
 
-def is_allowed(msg: Message) -> bool:
-    if msg is None:
-        logger.debug("Rejected: message is None")
-        return False
-    if msg.chat_id not in ALLOWED_CHAT_IDS:
-        logger.debug("Rejected: chat_id %s not in allowed list", msg.chat_id)
-        return False
-    if not msg.from_user.username:
-        logger.debug("Rejected: user %s has no username", msg.from_user.id)
-        return False
-    if not state.enabled:
-        logger.debug("Rejected: bot is disabled")
-        return False
-    return True
 
+async def send_ws(channel: Channel, data: dict, log: bool = True) -> None:
+    with tracing.span("send_ws", channel=channel.name, viewers=len(channel.viewers)):
+        await _send_ws(channel, data, log)
 
-async def react(msg: Message, emoji: str = "👍") -> None:
+
+async def _send_ws(channel: Channel, data: dict, log: bool) -> None:
+    async with channel.ws_lock:
+        if log:
+            channel.event_log.append(data)
+        for viewer in list(channel.viewers):
+            if not viewer.push(data, channel.current_message):
+                EVENTS_DROPPED.inc(reason="viewer_dropped")
+                logger.warning("Dropping slow WebSocket viewer %s on %s", viewer.name, channel.name)
+                channel.viewers.discard(viewer)
+                asyncio.create_task(viewer.close())
+        logger.info("Queued %s for %d viewer(s) on %s", describe(data), len(channel.viewers), channel.name)
+
+
+async def resolve_file_url(bot, file_id: str, file_unique_id: str) -> str:
+    async def lookup() -> str:
+        started = time.perf_counter()
+        try:
+            file = await bot.get_file(file_id)
+        except Exception:
+            GETFILE_ERRORS.inc()
+            raise
+        finally:
+            GETFILE_SECONDS.observe(time.perf_counter() - started)
+        if file.file_path.startswith("http"):
+            return file.file_path
+        return f"{TELEGRAM_API_BASE_URL}/file/bot{TELEGRAM_API_KEY}/{file.file_path}"
+
+    with tracing.span("get_file", file_unique_id=file_unique_id):
+        return await file_lookups.get(file_unique_id, lookup)
+
+
+async def show(channel: Channel, message: dict) -> None:
+    channel.current_message = {"message": message}
+    channel.upgrade_for = None
+    channel.shown_at = time.monotonic()
+    await send_ws(channel, channel.current_message)
+    channel.store.update(current_message=message)
+
+
+async def resolve_cached_media(bot, file_unique_id: str, fresh: bool = False) -> str | None:
+    """Download URL for media we showed before, looked up again via history; fresh skips cached lookups."""
+    # Previews are looked up too: a restored current message may be one still waiting for its upgrade
+    file_id = next(filter(None, (channel.history.file_id(file_unique_id) for channel in channels.values())), None)
+    if file_id is None:
+        return None
+    if fresh:
+        file_lookups.forget(file_unique_id)
     try:
-        await msg.set_reaction(emoji)
-    except Exception as e:
-        logger.warning("Failed to set reaction: %s", e)
+        return await resolve_file_url(bot, file_id, file_unique_id)
+    except TelegramError as e:
+        logger.warning("Failed to resolve %s from history: %s", file_unique_id, e)
+        return None
+
 
+async def prepare_media(bot, file_id: str, file_unique_id: str) -> str:
+    if file_unique_id not in media_cache:
+        source_url = await resolve_file_url(bot, file_id, file_unique_id)
+        media_cache.prefetch(file_unique_id, source_url, file_lookups.expires(file_unique_id))
+    return f"/media/{file_unique_id}"
+
+
+async def thumbnail_hash(bot, msg: Message) -> int | None:
+    """Perceptual hash of the smallest preview Telegram has for this media; a few KB to download."""
+    if msg.photo:
+        thumbnail = msg.photo[0]
+    else:
+        thumbnail = (msg.animation or msg.video or msg.video_note).thumbnail
+    if thumbnail is None:
+        return None
+    with tracing.span("phash", file_unique_id=thumbnail.file_unique_id):
+        try:
+            url = await resolve_file_url(bot, thumbnail.file_id, thumbnail.file_unique_id)
+        except TelegramError as e:
+            logger.warning("Failed to resolve thumbnail %s: %s", thumbnail.file_unique_id, e)
+            return None
+        media_cache.prefetch(thumbnail.file_unique_id, url, file_lookups.expires(thumbnail.file_unique_id))
+        cached = await media_cache.fetch(thumbnail.file_unique_id)
+        if cached is None:
+            return None
+        return await transcoder.dhash(cached.path)
+
+
+async def push_media(bot, channel: Channel, item: HistoryItem, origin: float) -> None:
+    if item.preview_file_id is None or item.file_unique_id in media_cache:
+        file_url = await prepare_media(bot, item.file_id, item.file_unique_id)
+        await show(channel, {"url": file_url, "type": item.type, "sender": item.sender})
+        channel.displays.track(channel.current_message, origin, trace=tracing.current())
+        return
 
-async def send_ws(data: dict) -> None:
-    async with state.ws_lock:
-        if state.ws_connection is None or state.ws_connection.closed:
+    # Not downloaded yet: put the small preview up now and swap in the full size once it is here
+    file_url, preview_url = await asyncio.gather(
+        prepare_media(bot, item.file_id, item.file_unique_id),
+        prepare_media(bot, item.preview_file_id, item.preview_file_unique_id),
+        return_exceptions=True,
+    )
+    if isinstance(file_url, BaseException):
+        raise file_url
+    message = {"url": file_url, "type": item.type, "sender": item.sender}
+    if isinstance(preview_url, BaseException):
+        logger.warning("Failed to prepare preview for %s: %s", item.file_unique_id, preview_url)
+        await show(channel, message)
+        channel.displays.track(channel.current_message, origin, trace=tracing.current())
+        return
+
+    await show(channel, {"url": preview_url, "type": "photo", "sender": item.sender, "preview": True})
+    channel.upgrade_for = item.file_unique_id
+    channel.displays.track(channel.current_message, origin, trace=tracing.current())
+    trace = tracing.current()
+    if trace is not None:
+        trace.hold()
+    asyncio.create_task(upgrade_media(channel, item.file_unique_id, message, origin))
+
+
+async def upgrade_media(channel: Channel, file_unique_id: str, message: dict, origin: float) -> None:
+    trace = tracing.current()
+    try:
+        with tracing.span("upgrade"):
+            cached = await media_cache.fetch(file_unique_id)
+        if cached is None:
+            logger.warning("Full size of %s never arrived, leaving the preview up on %s", file_unique_id, channel.name)
             return
+        # Still the preview of this media, even if a failed preview was re-sent since
+        if channel.upgrade_for != file_unique_id:
+            logger.debug("Screen %s moved on before %s finished downloading", channel.name, file_unique_id)
+            return
+        await show(channel, {**message, "upgrade": True})
+        channel.displays.track(channel.current_message, origin, trace=trace)
+    finally:
+        if trace is not None:
+            trace.release()
+
+
+def enqueue(channel: Channel, entry: PlaylistEntry) -> None:
+    entry.trace = tracing.current()
+    if entry.trace is not None:
+        entry.trace.hold().attrs["file_unique_id"] = entry.item.file_unique_id
+    dropped = channel.playlist.add(entry)
+    if dropped is not None:
+        EVENTS_DROPPED.inc(reason="superseded")
+        logger.info(
+            "Playlist for %s full, dropped %s %s", channel.name, dropped.item.type, dropped.item.file_unique_id
+        )
+        discard(dropped, "superseded")
+
+
+def discard(entry: PlaylistEntry, outcome: str) -> None:
+    """An entry leaves the playlist without getting on screen."""
+    if entry.on_dropped is not None:
+        entry.on_dropped()
+    if entry.trace is not None:
+        entry.trace.release(outcome=outcome)
+
+
+async def preload(bot, channel: Channel, entry: PlaylistEntry) -> None:
+    try:
+        file_url = await prepare_media(bot, entry.item.file_id, entry.item.file_unique_id)
+    except TelegramError as e:
+        logger.warning("Failed to preload %s: %s", entry.item.file_unique_id, e)
+        return
+    command = {"type": "preload", "url": file_url, "media_type": entry.item.type}
+    await send_ws(channel, {"command": command}, log=False)
+
+
+async def run_playlist(bot, channel: Channel) -> None:
+    playlist = channel.playlist
+    while True:
+        if not playlist:
+            timeout = None if MAX_DWELL <= 0 else max(0.0, channel.shown_at + MAX_DWELL - time.monotonic())
+            try:
+                await asyncio.wait_for(playlist.wait(), timeout)
+            except asyncio.TimeoutError:
+                item = channel.history.pick(prefer=lambda file_unique_id: file_unique_id in media_cache)
+                if item is not None and channel.enabled:
+                    logger.info(
+                        "Nothing new on %s for %ss, rotating to %s", channel.name, MAX_DWELL, item.file_unique_id
+                    )
+                    enqueue(channel, PlaylistEntry(item, time.time()))
+                else:
+                    channel.shown_at = time.monotonic()
+                continue
+
+        remaining = channel.shown_at + MIN_DWELL - time.monotonic()
+        if remaining > 0:
+            upcoming = playlist.peek()
+            with tracing.use(upcoming.trace):
+                try:
+                    await preload(bot, channel, upcoming)
+                except Exception:
+                    logger.exception("Failed to preload %s on %s", upcoming.item.file_unique_id, channel.name)
+            await asyncio.sleep(remaining)
+
+        entry = playlist.pop()
+        if entry is None:
+            continue
+        with tracing.use(entry.trace):
+            try:
+                outcome = await play(bot, channel, entry)
+            except Exception:
+                # Whatever went wrong is this entry's problem; the screen must keep going with the next one
+                logger.exception("Failed to show %s on %s", entry.item.file_unique_id, channel.name)
+                outcome = "error"
+        if outcome != "pushed":
+            discard(entry, outcome)
+        elif entry.trace is not None:
+            entry.trace.release(outcome=outcome)
+
+
+async def play(bot, channel: Channel, entry: PlaylistEntry) -> str:
+    if entry.trace is not None:
+        entry.trace.event("dequeued", channel=channel.name)
+    if not channel.enabled:
+        return "disabled"
+    try:
+        await push_media(bot, channel, entry.item, entry.origin)
+    except TelegramError as e:
+        logger.warning("Failed to show %s on %s: %s", entry.item.file_unique_id, channel.name, e)
+        return "error"
+    if entry.on_shown is not None:
+        entry.on_shown()
+    return "pushed"
+
+
+async def handle_ack(channel: Channel, data: dict) -> None:
+    seq = data.get("seq")
+    if not isinstance(seq, int) or data["ack"] not in ("received", "loaded", "failed"):
+        return
+    failed = channel.displays.ack(seq, data["ack"])
+    if failed is None:
+        return
+    with tracing.use(failed.trace):
         try:
-            await state.ws_connection.send_json(data)
-            key = "message" if "message" in data else "command"
-            logger.info("Sent %s to WebSocket: %s", key, data[key]["type"])
-        except ConnectionResetError:
-            logger.info("WebSocket connection closed, clearing")
-            state.ws_connection = None
+            await recover_display(channel, failed)
+        finally:
+            if failed.trace is not None:
+                failed.trace.release(outcome="failed")
 
 
+async def recover_display(channel: Channel, failed: PendingDisplay) -> None:
+    if channel.current_message is not failed.event:
+        return
+    seq = failed.event["seq"]
+    last_loaded = channel.displays.last_loaded
+    if failed.retries < DISPLAY_RETRIES:
+        retries = failed.retries + 1
+        url = failed.event["message"]["url"].split("?")[0]
+        logger.info("Retrying media #%d on %s (attempt %d)", seq, channel.name, retries)
+        upgrade_for = channel.upgrade_for
+        await show(channel, {**failed.event["message"], "url": f"{url}?retry={retries}"})
+        # It is the same media again, so a full-size upgrade still on its way should replace the retry
+        channel.upgrade_for = upgrade_for
+        channel.displays.track(channel.current_message, failed.origin, retries, failed.trace)
+    elif last_loaded is not None:
+        logger.info("Media #%d keeps failing on %s, falling back to #%d", seq, channel.name, last_loaded["seq"])
+        await show(channel, dict(last_loaded["message"]))
+
+
+@timed(HANDLER_SECONDS, handler="on")
 async def handle_on(update: Update, _) -> None:
     msg = update.message
     logger.debug("Received /on from user=%s (id=%s) chat=%s", msg.from_user.username, msg.from_user.id, msg.chat_id)
@@ -85,12 +446,17 @@ async def handle_on(update: Update, _) -> None:
     if msg.forward_date:
         logger.debug("Rejected /on: message is forwarded")
         return
-    state.enabled = True
-    logger.info("Bot enabled by admin %s", msg.from_user.id)
-    await msg.reply_text("Bot enabled")
-    await react(msg)
+    targets = admin_channels(msg)
+    for channel in targets:
+        channel.enabled = True
+        channel.store.update(enabled=True)
+    names = ", ".join(channel.name for channel in targets)
+    logger.info("Display(s) %s enabled by admin %s", names, msg.from_user.id)
+    reply(msg, "Bot enabled" if len(channels) == 1 else f"Enabled: {names}")
+    react(msg)
 
 
+@timed(HANDLER_SECONDS, handler="off")
 async def handle_off(update: Update, _) -> None:
     msg = update.message
     logger.debug("Received /off from user=%s (id=%s) chat=%s", msg.from_user.username, msg.from_user.id, msg.chat_id)
@@ -100,41 +466,93 @@ async def handle_off(update: Update, _) -> None:
     if msg.forward_date:
         logger.debug("Rejected /off: message is forwarded")
         return
-    state.enabled = False
-    logger.info("Bot disabled by admin %s", msg.from_user.id)
-    state.current_message = {"message": {"url": None, "type": "empty"}}
-    await send_ws(state.current_message)
-    await msg.reply_text("Bot disabled")
-    await react(msg)
-
-
+    targets = admin_channels(msg)
+    for channel in targets:
+        channel.enabled = False
+        for entry in channel.playlist.clear():
+            discard(entry, "disabled")
+        channel.store.update(enabled=False)
+        await show(channel, {"url": None, "type": "empty"})
+    names = ", ".join(channel.name for channel in targets)
+    logger.info("Display(s) %s disabled by admin %s", names, msg.from_user.id)
+    reply(msg, "Bot disabled" if len(channels) == 1 else f"Disabled: {names}")
+    react(msg)
+
+
+@timed(HANDLER_SECONDS, handler="display")
+@tracer.traced("display")
 async def handle_display(update: Update, _) -> None:
     msg = update.message
     logger.debug("Received /display from user=%s (id=%s) chat=%s", msg.from_user.username, msg.from_user.id, msg.chat_id)
-    if not is_allowed(msg):
+    targets = route(msg)
+    if not targets:
         return
 
     text = (msg.text or "")[9:]  # strip "/display "
     if not DISPLAY_TEXT_PATTERN.match(text):
         logger.info("Invalid display text from %s: %s", msg.from_user.first_name, text)
-        await react(msg, "👎")
+        react(msg, "👎")
+        return
+    if not throttle.allow(msg.from_user.id):
+        EVENTS_DROPPED.inc(reason="rate_limited")
+        logger.info("Rate limited /display from %s", msg.from_user.first_name)
         return
 
     logger.info("Display command from %s: %s", msg.from_user.first_name, text)
-    await send_ws({"command": {"type": "display", "text": text}})
-    await react(msg)
+    for channel in targets:
+        await send_ws(channel, {"command": {"type": "display", "text": text}})
+    react(msg)
 
 
-async def handle_random(update: Update, _) -> None:
+@timed(HANDLER_SECONDS, handler="noise")
+@tracer.traced("noise")
+async def handle_noise(update: Update, _) -> None:
     msg = update.message
-    logger.debug("Received /random from user=%s (id=%s) chat=%s", msg.from_user.username, msg.from_user.id, msg.chat_id)
-    if not is_allowed(msg):
+    logger.debug("Received /noise from user=%s (id=%s) chat=%s", msg.from_user.username, msg.from_user.id, msg.chat_id)
+    targets = route(msg)
+    if not targets:
+        return
+    if not throttle.allow(msg.from_user.id):
+        EVENTS_DROPPED.inc(reason="rate_limited")
+        logger.info("Rate limited /noise from %s", msg.from_user.first_name)
         return
-    logger.info("Random command from %s", msg.from_user.first_name)
-    await send_ws({"command": {"type": "random"}})
-    await react(msg)
 
+    logger.info("Noise command from %s", msg.from_user.first_name)
+    for channel in targets:
+        # A burst of noise is only fun when it happens; don't replay it to viewers that reconnect later
+        await send_ws(channel, {"command": {"type": "noise"}}, log=False)
+    react(msg)
 
+
+@timed(HANDLER_SECONDS, handler="random")
+@tracer.traced("random")
+async def handle_random(update: Update, context) -> None:
+    msg = update.message
+    logger.debug("Received /random from user=%s (id=%s) chat=%s", msg.from_user.username, msg.from_user.id, msg.chat_id)
+    targets = route(msg)
+    if not targets:
+        return
+    if not throttle.allow(msg.from_user.id):
+        EVENTS_DROPPED.inc(reason="rate_limited")
+        logger.info("Rate limited /random from %s", msg.from_user.first_name)
+        return
+    on_shown = once(lambda: react(msg))
+    queued = False
+    for channel in targets:
+        item = channel.history.pick(prefer=lambda file_unique_id: file_unique_id in media_cache)
+        if item is None:
+            continue
+        name = msg.from_user.first_name
+        logger.info("Random command from %s on %s: %s %s", name, channel.name, item.type, item.file_unique_id)
+        enqueue(channel, PlaylistEntry(item, msg.date.timestamp(), on_shown=on_shown))
+        queued = True
+    if not queued:
+        logger.info("Random command from %s, but media history is empty", msg.from_user.first_name)
+        react(msg, "👎")
+
+
+@timed(HANDLER_SECONDS, handler="media")
+@tracer.traced("media")
 async def handle_media(update: Update, context) -> None:
     msg = update.message
     logger.debug(
@@ -148,41 +566,114 @@ async def handle_media(update: Update, context) -> None:
         bool(msg.video_note),
         msg.has_media_spoiler,
     )
-    if not is_allowed(msg):
+    targets = route(msg)
+    if not targets:
         return
     if msg.has_media_spoiler:
         logger.debug("Rejected: message has media spoiler")
         return
 
-    file_id, media_type = None, None
+    media, media_type = None, None
     if msg.photo:
-        file_id, media_type = msg.photo[-1].file_id, "photo"
+        media, media_type = best_size(msg.photo, PANEL_WIDTH, PANEL_HEIGHT), "photo"
     elif msg.animation:
-        file_id, media_type = msg.animation.file_id, "video"
+        media, media_type = msg.animation, "video"
     elif msg.video:
-        file_id, media_type = msg.video.file_id, "video"
+        media, media_type = msg.video, "video"
     elif msg.video_note:
-        file_id, media_type = msg.video_note.file_id, "video"
+        media, media_type = msg.video_note, "video"
 
-    if not file_id:
+    if not media:
+        return
+    preview = preview_size(msg.photo, PREVIEW_MIN_SIDE) if msg.photo else media.thumbnail
+    if preview is not None and preview.file_unique_id == media.file_unique_id:
+        preview = None
+    if throttle.group_taken(msg.media_group_id):
+        EVENTS_DROPPED.inc(reason="album")
+        logger.debug("Rejected: album %s is already shown", msg.media_group_id)
         return
+    targets = [channel for channel in targets if not channel.recent.duplicate_of(media.file_unique_id)]
+    if not targets:
+        EVENTS_DROPPED.inc(reason="duplicate")
+        logger.info("Skipping repost of %s %s", media_type, media.file_unique_id)
+        return
+    if not throttle.allow(msg.from_user.id):
+        EVENTS_DROPPED.inc(reason="rate_limited")
+        logger.info("Rate limited %s from %s", media_type.upper(), msg.from_user.first_name)
+        return
+    # Claimed before the first await so the rest of the album, arriving alongside, sees it
+    throttle.take_group(msg.media_group_id)
 
+    phash = await thumbnail_hash(context.bot, msg) if PHASH and DEDUP_WINDOW > 0 else None
     logger.info("Detected %s from %s", media_type.upper(), msg.from_user.first_name)
-    file = await context.bot.get_file(file_id)
-    if file.file_path.startswith("http"):
-        file_url = file.file_path
-    else:
-        file_url = f"https://api.telegram.org/file/bot{TELEGRAM_API_KEY}/{file.file_path}"
-
     sender = msg.from_user.first_name + (" @" + msg.from_user.username if msg.from_user.username else "")
-    state.current_message = {"message": {"url": file_url, "type": media_type, "sender": sender}}
-    await send_ws(state.current_message)
-    await react(msg)
+    item = HistoryItem(media.file_unique_id, media.file_id, media_type, sender, time.time())
+    if preview is not None:
+        item.preview_file_id, item.preview_file_unique_id = preview.file_id, preview.file_unique_id
+    react_once = once(lambda: react(msg))
+
+    enqueued = False
+    for channel in targets:
+        original = channel.recent.duplicate_of(media.file_unique_id, phash)
+        if original is not None:
+            EVENTS_DROPPED.inc(reason="duplicate")
+            logger.info("Skipping %s %s on %s, looks like %s", media_type, media.file_unique_id, channel.name, original)
+            continue
+        # Recorded now so a repost arriving while this one waits is caught; forgotten if it never gets shown
+        channel.recent.add(media.file_unique_id, phash)
+
+        def on_shown(history=channel.history) -> None:
+            history.add(item)
+            react_once()
+
+        def on_dropped(recent=channel.recent) -> None:
+            recent.forget(media.file_unique_id)
+
+        entry = PlaylistEntry(item, msg.date.timestamp(), msg.from_user.id in ADMIN_IDS, on_shown, on_dropped)
+        enqueue(channel, entry)
+        enqueued = True
+    if not enqueued:
+        throttle.release_group(msg.media_group_id)
+
+
+async def index_handler(request: web.Request) -> web.Response:
+    return static_assets.respond(request, "index.html")
+
+
+async def page_handler(request: web.Request) -> web.Response:
+    return static_assets.respond(request, request.match_info["name"])
 
 
-async def index_handler(_: web.Request) -> web.Response:
-    index_path = Path(__file__).parent / "index.html"
-    return web.FileResponse(index_path)
+async def media_handler(request: web.Request) -> web.StreamResponse:
+    cached = await media_cache.fetch(request.match_info["file_unique_id"])
+    if cached is None:
+        raise web.HTTPNotFound()
+    return web.FileResponse(cached.path, headers={"Cache-Control": "public, max-age=31536000, immutable"})
+
+
+async def metrics_handler(_: web.Request) -> web.Response:
+    return web.Response(text=metrics.render(), content_type="text/plain", charset="utf-8")
+
+
+async def traces_handler(request: web.Request) -> web.Response:
+    if not hmac.compare_digest(request.query.get("api_key", ""), HARDWAVE_API_KEY):
+        raise web.HTTPForbidden()
+    return web.json_response(list(tracer.recent), dumps=lambda data: json.dumps(data, ensure_ascii=False))
+
+
+async def webhook_handler(request: web.Request) -> web.Response:
+    provided_secret = request.headers.get("X-Telegram-Bot-Api-Secret-Token", "")
+    if not hmac.compare_digest(provided_secret, WEBHOOK_SECRET):
+        logger.warning("Webhook request rejected: invalid secret token")
+        raise web.HTTPForbidden()
+    try:
+        data = await request.json()
+    except ValueError:
+        raise web.HTTPBadRequest()
+
+    tg_app = request.app[TG_APP]
+    await tg_app.update_queue.put(Update.de_json(data, tg_app.bot))
+    return web.Response()
 
 
 async def websocket_handler(request: web.Request) -> web.WebSocketResponse:
@@ -197,38 +688,127 @@ async def websocket_handler(request: web.Request) -> web.WebSocketResponse:
         await ws.close(code=aiohttp.WSCloseCode.POLICY_VIOLATION, message=b"Invalid API key")
         return ws
 
-    async with state.ws_lock:
-        if state.ws_connection is not None:
-            logger.info("Dropping old WebSocket connection")
-            try:
-                await state.ws_connection.close()
-            except Exception:
-                pass
-        state.ws_connection = ws
+    channel = channels.get(params["display"]) if "display" in params else next(iter(channels.values()))
+    if channel is None:
+        logger.warning("WebSocket connection rejected: unknown display %r", params["display"])
+        await ws.close(code=aiohttp.WSCloseCode.POLICY_VIOLATION, message=b"Unknown display")
+        return ws
 
-    logger.info("New WebSocket connection established")
-    initial = state.current_message or {"message": {"url": None, "type": "empty"}}
-    await ws.send_json(initial)
+    try:
+        since = int(params["since"]) if "since" in params else None
+    except ValueError:
+        since = None
+
+    viewer = Viewer(ws, request.remote or "unknown", WS_QUEUE_SIZE)
+    async with channel.ws_lock:
+        missed = channel.event_log.since(params.get("epoch", ""), since) if since is not None else None
+        if missed is None or len(missed) >= WS_QUEUE_SIZE:
+            missed = [channel.current_message or {"message": {"url": None, "type": "empty"}}]
+        for event in missed:
+            viewer.push(event)
+        viewer.push(channel.event_log.marker())
+        channel.viewers.add(viewer)
+    logger.info(
+        "New WebSocket connection from %s to %s (since=%s, %d missed event(s), %d viewer(s))",
+        viewer.name,
+        channel.name,
+        since,
+        len(missed),
+        len(channel.viewers),
+    )
 
     try:
-        async for _ in ws:
-            pass
+        async for frame in ws:
+            if frame.type != aiohttp.WSMsgType.TEXT:
+                continue
+            try:
+                data = json.loads(frame.data)
+            except ValueError:
+                logger.debug("Ignoring malformed frame from %s", viewer.name)
+                continue
+            if isinstance(data, dict) and "ack" in data:
+                await handle_ack(channel, data)
     finally:
-        async with state.ws_lock:
-            if state.ws_connection is ws:
-                state.ws_connection = None
-                logger.info("WebSocket connection closed")
+        async with channel.ws_lock:
+            channel.viewers.discard(viewer)
+        await viewer.close()
+        logger.info(
+            "WebSocket connection from %s to %s closed (%d viewer(s))", viewer.name, channel.name, len(channel.viewers)
+        )
 
     return ws
 
 
+def inherited_socket() -> socket.socket | None:
+    """The listening socket passed in by systemd socket activation (or any LISTEN_FDS launcher)."""
+    if os.environ.get("LISTEN_PID") != str(os.getpid()) or int(os.environ.get("LISTEN_FDS", "0")) < 1:
+        return None
+    return socket.socket(fileno=3)  # SD_LISTEN_FDS_START
+
+
+def listening_socket(port: int) -> socket.socket:
+    """Bind the port without SO_REUSEPORT, so only one instance can hold it.
+
+    Instances share STATE_DIR, MEDIA_CACHE_DIR and getUpdates, so a second one must not run alongside the first.
+    """
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind(("0.0.0.0", port))
+    sock.listen(128)
+    return sock
+
+
+async def drain_viewers() -> None:
+    """Tell every page when to come back, let queued frames go out, then close with 1012 Service Restart."""
+    closing = []
+    for channel in channels.values():
+        await send_ws(channel, {"command": {"type": "reconnect", "after_ms": RESTART_RECONNECT_MS}}, log=False)
+        async with channel.ws_lock:
+            closing.extend(channel.viewers)
+            channel.viewers.clear()
+    drained = await asyncio.gather(*(viewer.drain(DRAIN_TIMEOUT) for viewer in closing))
+    if not all(drained):
+        logger.warning("%d viewer(s) did not drain in %ss", drained.count(False), DRAIN_TIMEOUT)
+    await asyncio.gather(
+        *(viewer.close(aiohttp.WSCloseCode.SERVICE_RESTART, b"Restarting") for viewer in closing),
+        return_exceptions=True,
+    )
+    logger.info("Closed %d WebSocket viewer(s) for restart", len(closing))
+
+
 async def main() -> None:
-    tg_app = Application.builder().token(TELEGRAM_API_KEY).build()
+    # Take the port first, so an instance started while another still runs fails before touching any files
+    sock = inherited_socket()
+    inherited = sock is not None
+    if sock is None:
+        sock = listening_socket(WEBSOCKET_PORT)
+
+    # Restore what the screens showed before the restart before anything touches the network
+    for channel in channels.values():
+        channel.load()
+        logger.info(
+            "Restored %s: enabled=%s, current=%s, sources=%s",
+            channel.name,
+            channel.enabled,
+            channel.current_message and channel.current_message["message"],
+            channel.sources,
+        )
+
+    # Handlers run concurrently so a newer item can supersede one still waiting on Telegram
+    tg_app = (
+        Application.builder()
+        .token(TELEGRAM_API_KEY)
+        .base_url(f"{TELEGRAM_API_BASE_URL}/bot")
+        .base_file_url(f"{TELEGRAM_API_BASE_URL}/file/bot")
+        .concurrent_updates(True)
+        .build()
+    )
 
     tg_app.add_handler(CommandHandler("on", handle_on))
     tg_app.add_handler(CommandHandler("off", handle_off))
     tg_app.add_handler(CommandHandler("display", handle_display))
     tg_app.add_handler(CommandHandler("random", handle_random))
+    tg_app.add_handler(CommandHandler("noise", handle_noise))
     tg_app.add_handler(
         MessageHandler(
             filters.PHOTO | filters.VIDEO | filters.ANIMATION | filters.VIDEO_NOTE,
@@ -237,28 +817,80 @@ async def main() -> None:
     )
 
     web_app = web.Application()
+    static_assets.load()
     web_app.router.add_get("/", index_handler)
+    web_app.router.add_get(r"/{name:[A-Za-z0-9_-]+\.html}", page_handler)
     web_app.router.add_get("/ws", websocket_handler)
+    web_app.router.add_get("/media/{file_unique_id:[A-Za-z0-9_-]+}", media_handler)
+    web_app.router.add_get("/metrics", metrics_handler)
+    web_app.router.add_get("/debug/traces", traces_handler)
+    if WEBHOOK_URL:
+        web_app[TG_APP] = tg_app
+        web_app.router.add_post(urlsplit(WEBHOOK_URL).path or "/", webhook_handler)
+
+    if TRANSCODE:
+        media_cache.transform = transcoder
+        logger.info("Transcoding media for a %dx%d panel", PANEL_WIDTH, PANEL_HEIGHT)
+        if shutil.which("ffmpeg") is None or shutil.which("ffprobe") is None:
+            logger.warning("ffmpeg/ffprobe not found, videos will be served as is")
+
+    media_cache.resolve = functools.partial(resolve_cached_media, tg_app.bot)
+    await media_cache.start()
+    outbox.start()
+    loop_lag_task = asyncio.create_task(metrics.watch_loop_lag())
 
     runner = web.AppRunner(web_app)
     await runner.setup()
-    site = web.TCPSite(runner, "0.0.0.0", WEBSOCKET_PORT)
+    site = web.SockSite(runner, sock)
     await site.start()
-    logger.info("HTTP/WebSocket server started on port %s", WEBSOCKET_PORT)
+    if inherited:
+        logger.info("HTTP/WebSocket server started on inherited socket %s", sock.getsockname())
+    else:
+        logger.info("HTTP/WebSocket server started on port %s", WEBSOCKET_PORT)
+
+    stopping = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(sig, stopping.set)
 
     async with tg_app:
         await tg_app.start()
-        await tg_app.updater.start_polling(drop_pending_updates=True)
-        logger.info("Telegram bot started polling")
+        playlist_tasks = [asyncio.create_task(run_playlist(tg_app.bot, channel)) for channel in channels.values()]
+        webhook_set = False
+        if WEBHOOK_URL:
+            try:
+                webhook_set = await tg_app.bot.set_webhook(
+                    WEBHOOK_URL,
+                    secret_token=WEBHOOK_SECRET,
+                    allowed_updates=Update.ALL_TYPES,
+                    drop_pending_updates=DROP_PENDING_UPDATES,
+                )
+                logger.info("Telegram webhook set to %s", WEBHOOK_URL)
+            except TelegramError as e:
+                logger.error("Failed to set webhook, falling back to polling: %s", e)
+        if not webhook_set:
+            await tg_app.updater.start_polling(drop_pending_updates=DROP_PENDING_UPDATES)
+            logger.info("Telegram bot started polling")
 
         try:
-            await asyncio.Future()
-        except asyncio.CancelledError:
-            pass
+            await stopping.wait()
+            logger.info("Shutting down: telling viewers to reconnect to the next instance")
         finally:
-            await tg_app.updater.stop()
+            # With socket activation, new connections now wait in systemd's socket for the next instance
+            await site.stop()
+            if tg_app.updater.running:
+                await tg_app.updater.stop()
             await tg_app.stop()
+            for task in playlist_tasks:
+                task.cancel()
+            await drain_viewers()
+            await outbox.flush(DRAIN_TIMEOUT)
+            loop_lag_task.cancel()
             await runner.cleanup()
+            await outbox.close()
+            await media_cache.close()
+            if transcoder is not None:
+                transcoder.close()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,166 @@
+import asyncio
+import logging
+import os
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from pathlib import Path, PurePosixPath
+from typing import Awaitable, Callable
+from urllib.parse import urlsplit
+
+import aiohttp
+
+logger = logging.getLogger(__name__)
+
+MAX_KNOWN_SOURCES = 256
+
+
+@dataclass
+class CachedFile:
+    path: Path
+    size: int
+
+
+class MediaCache:
+    """Size-bounded LRU of downloaded Telegram files, kept on local (tmpfs) disk.
+
+    Download URLs handed to prefetch() are remembered until they expire, so an evicted file can
+    be fetched again; after that, or once a download from one fails, resolve(key, fresh) is
+    asked for a new URL.
+    """
+
+    def __init__(
+        self,
+        directory: Path,
+        max_bytes: int,
+        source_ttl: float,
+        transform: Callable[[Path], Awaitable[Path]] | None = None,
+    ) -> None:
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.source_ttl = source_ttl
+        self.transform = transform
+        self.resolve: Callable[[str, bool], Awaitable[str | None]] | None = None
+        self.total_bytes = 0
+        self._entries: OrderedDict[str, CachedFile] = OrderedDict()
+        self._sources: OrderedDict[str, tuple[float, str]] = OrderedDict()
+        self._pending: dict[str, asyncio.Task] = {}
+        self._session: aiohttp.ClientSession | None = None
+
+    async def start(self) -> None:
+        self.directory.mkdir(parents=True, exist_ok=True)
+        files = sorted((f for f in self.directory.iterdir() if f.is_file()), key=lambda f: f.stat().st_mtime)
+        for path in files:
+            if path.suffix == ".part":
+                path.unlink(missing_ok=True)
+                continue
+            entry = CachedFile(path=path, size=path.stat().st_size)
+            self._entries[path.stem] = entry
+            self.total_bytes += entry.size
+        self._evict()
+        if self._entries:
+            logger.info("Reusing %d cached media file(s), %d bytes", len(self._entries), self.total_bytes)
+        self._session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=120, sock_connect=10))
+
+    async def close(self) -> None:
+        for task in self._pending.values():
+            task.cancel()
+        if self._session is not None:
+            await self._session.close()
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._entries
+
+    def get(self, key: str) -> CachedFile | None:
+        entry = self._entries.get(key)
+        if entry is not None:
+            self._entries.move_to_end(key)
+        return entry
+
+    def prefetch(self, key: str, url: str, expires: float | None = None) -> asyncio.Task | None:
+        """Start downloading url unless key is cached; expires is when url goes stale (monotonic)."""
+        self._sources[key] = (expires if expires is not None else time.monotonic() + self.source_ttl, url)
+        self._sources.move_to_end(key)
+        while len(self._sources) > MAX_KNOWN_SOURCES:
+            self._sources.popitem(last=False)
+
+        if key in self._entries:
+            return None
+        task = self._pending.get(key)
+        if task is None:
+            task = asyncio.create_task(self._download(key, url))
+            self._pending[key] = task
+            task.add_done_callback(lambda _: self._pending.pop(key, None))
+        return task
+
+    async def fetch(self, key: str) -> CachedFile | None:
+        entry = self.get(key)
+        if entry is not None:
+            return entry
+        task = self._pending.get(key)
+        if task is not None:
+            return await asyncio.shield(task)
+
+        source = self._sources.get(key)
+        if source is not None and source[0] <= time.monotonic():
+            del self._sources[key]
+            source = None
+        if source is not None:
+            expires, url = source
+            entry = await self._fetch_url(key, url, expires)
+            if entry is not None:
+                return entry
+        if self.resolve is None:
+            return None
+        # Nothing remembered, or it is too old, or it just failed: get a new URL
+        url = await self.resolve(key, source is not None)
+        if url is None:
+            return None
+        return await self._fetch_url(key, url)
+
+    async def _fetch_url(self, key: str, url: str, expires: float | None = None) -> CachedFile | None:
+        task = self.prefetch(key, url, expires)
+        if task is None:
+            return self.get(key)
+        return await asyncio.shield(task)
+
+    async def _download(self, key: str, url: str) -> CachedFile | None:
+        suffix = PurePosixPath(urlsplit(url).path).suffix
+        path = self.directory / f"{key}{suffix}"
+        tmp_path = path.with_name(path.name + ".part")
+        size = 0
+        try:
+            async with self._session.get(url) as response:
+                response.raise_for_status()
+                with tmp_path.open("wb") as f:
+                    async for chunk in response.content.iter_chunked(64 * 1024):
+                        size += len(chunk)
+                        if size > self.max_bytes:
+                            raise ValueError(f"file exceeds cache size ({self.max_bytes} bytes)")
+                        f.write(chunk)
+            os.replace(tmp_path, path)
+        except Exception as e:
+            # Not str(e): aiohttp's errors include the URL, and Telegram's file URLs contain the bot token
+            status = getattr(e, "status", None)
+            logger.warning("Failed to download media %s: %s%s", key, type(e).__name__, f" {status}" if status else "")
+            tmp_path.unlink(missing_ok=True)
+            self._sources.pop(key, None)
+            return None
+
+        if self.transform is not None:
+            path = await self.transform(path)
+            size = path.stat().st_size
+
+        entry = CachedFile(path=path, size=size)
+        self._entries[key] = entry
+        self.total_bytes += size
+        self._evict()
+        logger.info("Cached media %s (%d bytes, %d/%d bytes used)", key, size, self.total_bytes, self.max_bytes)
+        return entry
+
+    def _evict(self) -> None:
+        while self.total_bytes > self.max_bytes and len(self._entries) > 1:
+            key, entry = self._entries.popitem(last=False)
+            self.total_bytes -= entry.size
+            entry.path.unlink(missing_ok=True)
+            logger.debug("Evicted media %s (%d bytes)", key, entry.size)
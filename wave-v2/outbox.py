@@ -0,0 +1,96 @@
+import asyncio
+import logging
+import random
+import time
+from dataclasses import dataclass, field
+from datetime import timedelta
+from typing import Awaitable, Callable
+
+from telegram.error import BadRequest, NetworkError, RetryAfter, TelegramError
+
+from metrics import EVENTS_DROPPED
+
+logger = logging.getLogger(__name__)
+
+MAX_ATTEMPTS = 5
+MAX_BACKOFF = 30
+
+
+@dataclass
+class OutgoingAction:
+    kind: str
+    call: Callable[[], Awaitable]
+    created: float = field(default_factory=time.monotonic)
+
+
+class Outbox:
+    """Sends reactions and replies in the background, honoring Telegram flood control."""
+
+    def __init__(self, size: int, max_reaction_age: float) -> None:
+        self.max_reaction_age = max_reaction_age
+        self.queue: asyncio.Queue[OutgoingAction] = asyncio.Queue(maxsize=size)
+        self._task: asyncio.Task | None = None
+
+    def start(self) -> None:
+        self._task = asyncio.create_task(self._worker())
+
+    async def close(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+    async def flush(self, timeout: float) -> None:
+        try:
+            await asyncio.wait_for(self.queue.join(), timeout)
+        except asyncio.TimeoutError:
+            logger.warning("Outbox still had %d action(s) after %ss, dropping them", self.queue.qsize(), timeout)
+
+    def submit(self, kind: str, call: Callable[[], Awaitable]) -> None:
+        try:
+            self.queue.put_nowait(OutgoingAction(kind, call))
+        except asyncio.QueueFull:
+            EVENTS_DROPPED.inc(reason="outbox_full")
+            logger.warning("Outbox is full, dropping %s", kind)
+
+    def _is_stale(self, action: OutgoingAction) -> bool:
+        return action.kind == "reaction" and time.monotonic() - action.created > self.max_reaction_age
+
+    async def _worker(self) -> None:
+        while True:
+            action = await self.queue.get()
+            try:
+                await self._send(action)
+            except Exception as e:
+                logger.warning("Failed to send %s: %s", action.kind, e)
+            finally:
+                self.queue.task_done()
+
+    async def _send(self, action: OutgoingAction) -> None:
+        backoff = 1.0
+        for attempt in range(1, MAX_ATTEMPTS + 1):
+            if self._is_stale(action):
+                EVENTS_DROPPED.inc(reason="stale_reaction")
+                logger.info("Dropping stale %s", action.kind)
+                return
+            try:
+                await action.call()
+                return
+            except RetryAfter as e:
+                wait = e.retry_after.total_seconds() if isinstance(e.retry_after, timedelta) else e.retry_after
+                logger.warning("Flood control on %s, pausing outbox for %ss", action.kind, wait)
+                await asyncio.sleep(wait)
+            except BadRequest as e:
+                logger.warning("Failed to send %s: %s", action.kind, e)
+                return
+            except NetworkError as e:
+                delay = min(backoff, MAX_BACKOFF) * random.uniform(0.5, 1.5)
+                logger.info("Network error on %s (attempt %d): %s, retrying in %.1fs", action.kind, attempt, e, delay)
+                await asyncio.sleep(delay)
+                backoff *= 2
+            except TelegramError as e:
+                logger.warning("Failed to send %s: %s", action.kind, e)
+                return
+        logger.warning("Giving up on %s after %d attempts", action.kind, MAX_ATTEMPTS)
@@ -0,0 +1,21 @@
+from typing import Sequence
+
+from telegram import PhotoSize
+
+
+def best_size(sizes: Sequence[PhotoSize], width: int, height: int) -> PhotoSize:
+    """Smallest size that still fills a width x height panel when fitted; the largest one if none does."""
+    ordered = sorted(sizes, key=lambda size: size.width * size.height)
+    for size in ordered:
+        if size.width >= width or size.height >= height:
+            return size
+    return ordered[-1]
+
+
+def preview_size(sizes: Sequence[PhotoSize], min_side: int) -> PhotoSize:
+    """Smallest size whose long side is at least min_side, so a preview is not just a blur."""
+    ordered = sorted(sizes, key=lambda size: size.width * size.height)
+    for size in ordered:
+        if max(size.width, size.height) >= min_side:
+            return size
+    return ordered[-1]
@@ -0,0 +1,62 @@
+import asyncio
+from collections import deque
+from dataclasses import dataclass
+from typing import Callable
+
+from history import HistoryItem
+from tracing import Trace
+
+
+@dataclass
+class PlaylistEntry:
+    item: HistoryItem
+    origin: float
+    priority: bool = False
+    on_shown: Callable[[], None] | None = None
+    on_dropped: Callable[[], None] | None = None
+    trace: Trace | None = None
+
+
+class Playlist:
+    """Bounded queue of media waiting for the screen; priority entries go ahead of everyone else."""
+
+    def __init__(self, size: int) -> None:
+        self.size = size
+        self._entries: deque[PlaylistEntry] = deque()
+        self._changed = asyncio.Event()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def add(self, entry: PlaylistEntry) -> PlaylistEntry | None:
+        """Queue an entry; returns whatever had to be dropped to make room."""
+        if entry.priority:
+            position = next((i for i, queued in enumerate(self._entries) if not queued.priority), len(self._entries))
+            self._entries.insert(position, entry)
+        else:
+            self._entries.append(entry)
+        self._changed.set()
+
+        if len(self._entries) <= self.size:
+            return None
+        # Drop the oldest regular entry; only if everything is priority, drop the oldest of those
+        victim = next((queued for queued in self._entries if not queued.priority), self._entries[0])
+        self._entries.remove(victim)
+        return victim
+
+    def peek(self) -> PlaylistEntry | None:
+        return self._entries[0] if self._entries else None
+
+    def pop(self) -> PlaylistEntry | None:
+        return self._entries.popleft() if self._entries else None
+
+    def clear(self) -> list[PlaylistEntry]:
+        """Empty the queue; returns what was in it."""
+        entries = list(self._entries)
+        self._entries.clear()
+        return entries
+
+    async def wait(self) -> None:
+        while not self._entries:
+            self._changed.clear()
+            await self._changed.wait()
@@ -0,0 +1,58 @@
+import json
+import logging
+import os
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+
+class StateStore:
+    """Small key/value state kept as a snapshot file plus an append-only log of changes."""
+
+    def __init__(self, directory: Path, max_log_entries: int = 100) -> None:
+        self.snapshot_path = directory / "state.json"
+        self.log_path = directory / "state.log"
+        self.max_log_entries = max_log_entries
+        self._values: dict = {}
+        self._log_entries = 0
+
+    def load(self) -> dict:
+        self.snapshot_path.parent.mkdir(parents=True, exist_ok=True)
+        try:
+            self._values = json.loads(self.snapshot_path.read_text())
+        except FileNotFoundError:
+            pass
+        except ValueError as e:
+            logger.warning("Ignoring corrupt state snapshot: %s", e)
+
+        if self.log_path.exists():
+            with self.log_path.open() as f:
+                for line in f:
+                    try:
+                        self._values.update(json.loads(line))
+                    except ValueError:
+                        # A torn last line from a crash mid-write
+                        logger.warning("Ignoring bad state log line")
+                    self._log_entries += 1
+        return dict(self._values)
+
+    def update(self, **changes) -> None:
+        self._values.update(changes)
+        try:
+            with self.log_path.open("a") as f:
+                f.write(json.dumps(changes, ensure_ascii=False) + "\n")
+            self._log_entries += 1
+            if self._log_entries >= self.max_log_entries:
+                self._compact()
+        except OSError as e:
+            logger.warning("Failed to persist state: %s", e)
+
+    def _compact(self) -> None:
+        tmp_path = self.snapshot_path.with_name(self.snapshot_path.name + ".tmp")
+        with tmp_path.open("w") as f:
+            json.dump(self._values, f, ensure_ascii=False)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.snapshot_path)
+        self.log_path.unlink(missing_ok=True)
+        self._log_entries = 0
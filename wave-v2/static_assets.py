@@ -0,0 +1,81 @@
+import gzip
+import hashlib
+import logging
+import mimetypes
+import time
+from dataclasses import dataclass
+from pathlib import Path
+
+from aiohttp import web
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+CHECK_INTERVAL = 1.0
+
+
+@dataclass
+class Asset:
+    path: Path
+    mtime_ns: int
+    digest: str
+    content_type: str
+    variants: dict[str, bytes]
+    checked: float
+
+
+class StaticAssets:
+    """In-memory copies of the kiosk pages, precompressed and served with strong ETags."""
+
+    def __init__(self, directory: Path, pattern: str = "*.html") -> None:
+        self.directory = directory
+        self.pattern = pattern
+        self._assets: dict[str, Asset] = {}
+
+    def load(self) -> None:
+        for path in sorted(self.directory.glob(self.pattern)):
+            self._assets[path.name] = self._read(path)
+        logger.info("Loaded %d static asset(s): %s", len(self._assets), ", ".join(self._assets))
+
+    def _read(self, path: Path) -> Asset:
+        stat = path.stat()
+        body = path.read_bytes()
+        variants = {"identity": body, "gzip": gzip.compress(body, compresslevel=9)}
+        if brotli is not None:
+            variants["br"] = brotli.compress(body)
+        content_type = mimetypes.guess_type(path.name)[0] or "application/octet-stream"
+        digest = hashlib.sha256(body).hexdigest()[:16]
+        return Asset(path, stat.st_mtime_ns, digest, content_type, variants, time.monotonic())
+
+    def get(self, name: str) -> Asset | None:
+        asset = self._assets.get(name)
+        if asset is None or time.monotonic() - asset.checked < CHECK_INTERVAL:
+            return asset
+        asset.checked = time.monotonic()
+        try:
+            if asset.path.stat().st_mtime_ns != asset.mtime_ns:
+                asset = self._assets[name] = self._read(asset.path)
+                logger.info("Reloaded static asset %s", name)
+        except OSError as e:
+            logger.warning("Failed to reload static asset %s: %s", name, e)
+        return asset
+
+    def respond(self, request: web.Request, name: str) -> web.Response:
+        asset = self.get(name)
+        if asset is None:
+            raise web.HTTPNotFound()
+
+        accepted = request.headers.get("Accept-Encoding", "")
+        encoding = next((e for e in ("br", "gzip") if e in asset.variants and e in accepted), "identity")
+        etag = f'"{asset.digest}"' if encoding == "identity" else f'"{asset.digest}-{encoding}"'
+        headers = {"ETag": etag, "Cache-Control": "no-cache", "Vary": "Accept-Encoding"}
+
+        if etag in request.headers.get("If-None-Match", ""):
+            return web.Response(status=304, headers=headers)
+        if encoding != "identity":
+            headers["Content-Encoding"] = encoding
+        return web.Response(body=asset.variants[encoding], content_type=asset.content_type, headers=headers)
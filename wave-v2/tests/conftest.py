@@ -0,0 +1,5 @@
+import sys
+from pathlib import Path
+
+# The server's modules live next to main.py rather than in a package
+sys.path.insert(0, str(Path(__file__).parent.parent))
@@ -0,0 +1,28 @@
+from dedup import RecentMedia
+from history import HistoryItem
+from playlist import Playlist, PlaylistEntry
+
+
+def test_repost_is_a_duplicate_while_the_original_waits():
+    recent = RecentMedia(3600, 10, 0)
+    recent.add("a")
+    assert recent.duplicate_of("a") == "a"
+
+
+def test_hash_matches_within_distance():
+    recent = RecentMedia(3600, 10, 2)
+    recent.add("a", 0b1111)
+    assert recent.duplicate_of("b", 0b1100) == "a"
+    assert recent.duplicate_of("c", 0b0000) is None
+
+
+def test_enqueued_cleared_then_reposted_is_accepted():
+    recent = RecentMedia(3600, 10, 2)
+    playlist = Playlist(5)
+    recent.add("a", 0b1111)
+    playlist.add(PlaylistEntry(HistoryItem("a", "a", "photo", "sender", 0.0), 0.0,
+                               on_dropped=lambda: recent.forget("a")))
+    for entry in playlist.clear():
+        entry.on_dropped()
+    assert recent.duplicate_of("a") is None
+    assert recent.duplicate_of("b", 0b1111) is None
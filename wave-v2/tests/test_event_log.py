@@ -0,0 +1,53 @@
+from event_log import EventLog
+
+
+def filled(size: int, *events: dict) -> EventLog:
+    log = EventLog(size)
+    for event in events:
+        log.append(dict(event))
+    return log
+
+
+def test_up_to_date_viewer_gets_nothing():
+    log = filled(10, {"message": 1}, {"command": "reload"})
+    assert log.since(log.epoch, 2) == []
+
+
+def test_missed_commands_are_replayed_in_order():
+    log = filled(10, {"message": 1}, {"command": "a"}, {"command": "b"})
+    assert [event.get("command") for event in log.since(log.epoch, 1)] == ["a", "b"]
+
+
+def test_only_the_newest_missed_message_is_replayed():
+    log = filled(10, {"message": 1}, {"command": "a"}, {"message": 2}, {"message": 3}, {"command": "b"})
+    delta = log.since(log.epoch, 1)
+    assert [event["seq"] for event in delta] == [2, 4, 5]
+    assert delta[1]["message"] == 3
+
+
+def test_other_epoch_needs_a_snapshot():
+    log = filled(10, {"message": 1})
+    assert log.since("someone-else", 0) is None
+
+
+def test_seq_from_the_future_needs_a_snapshot():
+    # A viewer claiming more than we ever sent is not talking about this log
+    log = filled(10, {"message": 1})
+    assert log.since(log.epoch, 5) is None
+
+
+def test_resume_point_just_before_the_oldest_kept_event_still_works():
+    log = filled(3, *({"command": str(i)} for i in range(1, 6)))  # keeps seq 3..5
+    assert [event["seq"] for event in log.since(log.epoch, 2)] == [3, 4, 5]
+
+
+def test_resume_point_already_rolled_out_of_the_buffer_needs_a_snapshot():
+    log = filled(3, *({"command": str(i)} for i in range(1, 6)))
+    assert log.since(log.epoch, 1) is None
+
+
+def test_events_are_stamped_with_seq_and_epoch():
+    log = EventLog(2)
+    event = log.append({"message": 1})
+    assert (event["seq"], event["epoch"]) == (1, log.epoch)
+    assert log.marker() == {"current": True, "seq": 1, "epoch": log.epoch}
@@ -0,0 +1,45 @@
+from history import HistoryItem, MediaHistory
+
+
+def item(name: str, preview: bool = True) -> HistoryItem:
+    return HistoryItem(
+        name, f"file-{name}", "photo", "sender", 0.0,
+        preview_file_id=f"file-{name}p" if preview else None,
+        preview_file_unique_id=f"{name}p" if preview else None,
+    )
+
+
+def test_file_id_resolves_main_files_and_previews():
+    history = MediaHistory(None, 5)
+    history.add(item("a"))
+    history.add(item("b", preview=False))
+    assert history.file_id("a") == "file-a"
+    assert history.file_id("ap") == "file-ap"
+    assert history.file_id("b") == "file-b"
+    assert history.file_id("unknown") is None
+
+
+def test_evicted_items_take_their_previews_with_them():
+    history = MediaHistory(None, 2)
+    for name in "abc":
+        history.add(item(name))
+    assert history.file_id("a") is None and history.file_id("ap") is None
+    assert history.file_id("cp") == "file-cp"
+
+
+def test_re_adding_an_item_replaces_its_preview():
+    history = MediaHistory(None, 5)
+    history.add(item("a"))
+    history.add(HistoryItem("a", "file-a", "photo", "sender", 1.0, "file-new", "new"))
+    assert history.file_id("ap") is None
+    assert history.file_id("new") == "file-new"
+    assert len(history) == 1
+
+
+def test_previews_survive_a_restart(tmp_path):
+    path = tmp_path / "history.jsonl"
+    history = MediaHistory(path, 5)
+    history.add(item("a"))
+    restored = MediaHistory(path, 5)
+    restored.load()
+    assert restored.file_id("ap") == "file-ap"
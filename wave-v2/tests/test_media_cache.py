@@ -0,0 +1,44 @@
+import asyncio
+import logging
+
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+from media_cache import MediaCache
+
+TOKEN = "123:SECRET"
+
+
+async def download_from_stub(tmp_path, handler):
+    """Serve handler as Telegram's file endpoint and download one file from it through the cache."""
+    app = web.Application()
+    app.router.add_get("/file/bot{token}/{path:.*}", handler)
+    server = TestServer(app)
+    await server.start_server()
+    cache = MediaCache(tmp_path, 1_000_000, 3600)
+    await cache.start()
+    try:
+        return await cache.prefetch("a", str(server.make_url(f"/file/bot{TOKEN}/photos/a.jpg")))
+    finally:
+        await cache.close()
+        await server.close()
+
+
+def test_failed_download_does_not_log_the_bot_token(tmp_path, caplog):
+    async def expired(request):
+        raise web.HTTPNotFound()
+
+    with caplog.at_level(logging.DEBUG, logger="media_cache"):
+        assert asyncio.run(download_from_stub(tmp_path, expired)) is None
+    assert "Failed to download media a: ClientResponseError 404" in caplog.text
+    assert TOKEN not in caplog.text
+    assert not list(tmp_path.iterdir())
+
+
+def test_download_is_cached(tmp_path):
+    async def photo(request):
+        return web.Response(body=b"jpeg")
+
+    entry = asyncio.run(download_from_stub(tmp_path, photo))
+    assert entry.path == tmp_path / "a.jpg"
+    assert entry.path.read_bytes() == b"jpeg"
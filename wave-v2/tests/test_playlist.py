@@ -0,0 +1,71 @@
+from history import HistoryItem
+from playlist import Playlist, PlaylistEntry
+
+
+def entry(name: str, priority: bool = False) -> PlaylistEntry:
+    return PlaylistEntry(HistoryItem(name, name, "photo", "sender", 0.0), origin=0.0, priority=priority)
+
+
+def names(playlist: Playlist) -> list[str]:
+    result = []
+    while (queued := playlist.pop()) is not None:
+        result.append(queued.item.file_unique_id)
+    return result
+
+
+def test_regular_entries_play_in_order():
+    playlist = Playlist(5)
+    for name in "abc":
+        assert playlist.add(entry(name)) is None
+    assert names(playlist) == ["a", "b", "c"]
+
+
+def test_full_playlist_drops_the_oldest_regular_entry():
+    playlist = Playlist(2)
+    playlist.add(entry("a"))
+    playlist.add(entry("b"))
+    dropped = playlist.add(entry("c"))
+    assert dropped.item.file_unique_id == "a"
+    assert names(playlist) == ["b", "c"]
+
+
+def test_priority_entries_go_ahead_of_regular_ones_but_keep_their_own_order():
+    playlist = Playlist(5)
+    playlist.add(entry("a"))
+    playlist.add(entry("p1", priority=True))
+    playlist.add(entry("b"))
+    playlist.add(entry("p2", priority=True))
+    assert names(playlist) == ["p1", "p2", "a", "b"]
+
+
+def test_priority_entry_evicts_a_regular_one_rather_than_another_priority_entry():
+    playlist = Playlist(2)
+    playlist.add(entry("p1", priority=True))
+    playlist.add(entry("a"))
+    dropped = playlist.add(entry("p2", priority=True))
+    assert dropped.item.file_unique_id == "a"
+    assert names(playlist) == ["p1", "p2"]
+
+
+def test_all_priority_playlist_drops_the_oldest_priority_entry():
+    playlist = Playlist(2)
+    for name in ("p1", "p2", "p3"):
+        dropped = playlist.add(entry(name, priority=True))
+    assert dropped.item.file_unique_id == "p1"
+    assert names(playlist) == ["p2", "p3"]
+
+
+def test_regular_entry_into_a_full_priority_playlist_is_dropped_itself():
+    playlist = Playlist(1)
+    playlist.add(entry("p1", priority=True))
+    dropped = playlist.add(entry("a"))
+    assert dropped.item.file_unique_id == "a"
+    assert names(playlist) == ["p1"]
+
+
+def test_clear_returns_what_was_queued():
+    playlist = Playlist(5)
+    for name in "ab":
+        playlist.add(entry(name))
+    assert [queued.item.file_unique_id for queued in playlist.clear()] == ["a", "b"]
+    assert not playlist
@@ -0,0 +1,29 @@
+from throttle import Throttle
+
+
+def test_album_is_shown_once_taken():
+    throttle = Throttle(1, 10, 1, 10)
+    assert not throttle.group_taken("album")
+    throttle.take_group("album")
+    assert throttle.group_taken("album")
+    assert not throttle.group_taken("other")
+
+
+def test_released_album_lets_the_next_item_through():
+    throttle = Throttle(1, 10, 1, 10)
+    throttle.take_group("album")
+    throttle.release_group("album")
+    assert not throttle.group_taken("album")
+
+
+def test_single_media_never_counts_as_an_album():
+    throttle = Throttle(1, 10, 1, 10)
+    throttle.take_group(None)
+    throttle.release_group(None)
+    assert not throttle.group_taken(None)
+
+
+def test_user_bucket_allows_a_burst_then_limits():
+    throttle = Throttle(0.001, 2, 100, 100)
+    assert [throttle.allow(1) for _ in range(3)] == [True, True, False]
+    assert throttle.allow(2)
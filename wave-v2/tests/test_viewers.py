@@ -0,0 +1,47 @@
+import asyncio
+
+from viewers import Viewer
+
+
+class FakeWebSocket:
+    def __init__(self, fail: bool = False) -> None:
+        self.fail = fail
+        self.sent: list[dict] = []
+        self.unblocked = asyncio.Event()
+
+    async def send_json(self, data: dict) -> None:
+        await self.unblocked.wait()
+        if self.fail:
+            raise ConnectionResetError()
+        self.sent.append(data)
+
+    async def close(self, **kwargs) -> None:
+        pass
+
+
+def test_overflow_keeps_latest_and_new_even_with_a_queue_of_one():
+    async def run():
+        ws = FakeWebSocket()
+        viewer = Viewer(ws, "slow", 1)
+        latest = {"seq": 1}
+        for seq in range(1, 5):
+            assert viewer.push({"seq": seq}, latest)
+        ws.unblocked.set()
+        assert await viewer.drain(1)
+        await viewer.close()
+        return [data["seq"] for data in ws.sent]
+
+    # Each overflow collapses the queue to the latest state plus the new message
+    assert asyncio.run(run()) == [1, 4]
+
+
+def test_drain_does_not_wait_for_a_dead_socket():
+    async def run():
+        ws = FakeWebSocket(fail=True)
+        viewer = Viewer(ws, "gone", 16)
+        for seq in range(3):
+            viewer.push({"seq": seq})
+        ws.unblocked.set()
+        return await viewer.drain(1)
+
+    assert asyncio.run(run())
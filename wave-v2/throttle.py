@@ -0,0 +1,63 @@
+import time
+from collections import OrderedDict
+
+MAX_TRACKED_USERS = 1024
+MAX_TRACKED_GROUPS = 256
+
+
+class TokenBucket:
+    def __init__(self, rate: float, burst: int) -> None:
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+
+    def level(self) -> float:
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        return self.tokens
+
+    def take(self) -> None:
+        self.tokens -= 1
+
+
+class Throttle:
+    """Per-user and global token buckets, and album collapsing."""
+
+    def __init__(self, user_rate: float, user_burst: int, global_rate: float, global_burst: int) -> None:
+        self.user_rate = user_rate
+        self.user_burst = user_burst
+        self.global_bucket = TokenBucket(global_rate, global_burst)
+        self._users: OrderedDict[int, TokenBucket] = OrderedDict()
+        self._groups: OrderedDict[str, None] = OrderedDict()
+
+    def allow(self, user_id: int) -> bool:
+        bucket = self._users.get(user_id)
+        if bucket is None:
+            bucket = self._users[user_id] = TokenBucket(self.user_rate, self.user_burst)
+            if len(self._users) > MAX_TRACKED_USERS:
+                self._users.popitem(last=False)
+        self._users.move_to_end(user_id)
+
+        if bucket.level() < 1 or self.global_bucket.level() < 1:
+            return False
+        bucket.take()
+        self.global_bucket.take()
+        return True
+
+    def group_taken(self, media_group_id: str | None) -> bool:
+        """Whether another item of this album already made it to the screen (or is on its way)."""
+        return media_group_id is not None and media_group_id in self._groups
+
+    def take_group(self, media_group_id: str | None) -> None:
+        if media_group_id is None:
+            return
+        self._groups[media_group_id] = None
+        if len(self._groups) > MAX_TRACKED_GROUPS:
+            self._groups.popitem(last=False)
+
+    def release_group(self, media_group_id: str | None) -> None:
+        """Let the next item of the album have a go after all, e.g. when this one turned out to be a repost."""
+        if media_group_id is not None:
+            self._groups.pop(media_group_id, None)
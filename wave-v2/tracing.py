@@ -0,0 +1,180 @@
+import functools
+import json
+import logging
+import random
+import secrets
+import time
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from pathlib import Path
+from typing import Awaitable, Callable
+
+logger = logging.getLogger(__name__)
+
+MAX_OPEN = 256
+
+_current: ContextVar["Trace | None"] = ContextVar("trace", default=None)
+
+
+class Trace:
+    """Spans recorded for one update, from Telegram receipt until the last part of its work is done.
+
+    Work that outlives the handler (the playlist, the outbox, client acks) holds the trace and
+    releases it when done; the trace is written out once nothing holds it any more.
+    """
+
+    def __init__(self, tracer: "Tracer", name: str, attrs: dict) -> None:
+        self.tracer = tracer
+        self.trace_id = secrets.token_hex(8)
+        self.name = name
+        self.attrs = attrs
+        self.started = time.time()
+        self.spans: list[dict] = []
+        self._t0 = time.perf_counter()
+        self._holds = 1
+
+    def _offset(self) -> float:
+        return round((time.perf_counter() - self._t0) * 1000, 3)
+
+    def event(self, name: str, **attrs) -> None:
+        self.spans.append({"name": name, "start_ms": self._offset(), "duration_ms": 0, **attrs})
+
+    @contextmanager
+    def span(self, name: str, **attrs):
+        record = {"name": name, "start_ms": self._offset(), **attrs}
+        self.spans.append(record)
+        started = time.perf_counter()
+        try:
+            yield record
+        except BaseException as e:
+            record["error"] = type(e).__name__
+            raise
+        finally:
+            record["duration_ms"] = round((time.perf_counter() - started) * 1000, 3)
+
+    def hold(self) -> "Trace":
+        self._holds += 1
+        return self
+
+    def release(self, **attrs) -> None:
+        self.attrs.update(attrs)
+        self._holds -= 1
+        if self._holds == 0:
+            self.tracer.finish(self)
+
+    def to_dict(self) -> dict:
+        return {
+            "trace_id": self.trace_id,
+            "name": self.name,
+            "started": self.started,
+            "duration_ms": self._offset(),
+            **self.attrs,
+            "spans": self.spans,
+        }
+
+
+class Tracer:
+    """Samples updates into traces and writes finished ones to a JSON-lines file and a ring for /debug/traces."""
+
+    def __init__(self, path: Path | None, sample_rate: float, keep: int, timeout: float) -> None:
+        self.path = path
+        self.sample_rate = sample_rate
+        self.timeout = timeout
+        self.recent: deque[dict] = deque(maxlen=keep)
+        self._open: OrderedDict[str, Trace] = OrderedDict()
+
+    def start(self, name: str, **attrs) -> Trace | None:
+        self._expire()
+        if self.sample_rate <= 0 or random.random() >= self.sample_rate:
+            return None
+        trace = Trace(self, name, attrs)
+        self._open[trace.trace_id] = trace
+        while len(self._open) > MAX_OPEN:
+            self.finish(next(iter(self._open.values())), incomplete=True)
+        return trace
+
+    def finish(self, trace: Trace, **attrs) -> None:
+        if self._open.pop(trace.trace_id, None) is None:
+            return
+        trace.attrs.update(attrs)
+        record = trace.to_dict()
+        self.recent.append(record)
+        if self.path is None:
+            return
+        try:
+            with self.path.open("a") as f:
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+        except OSError as e:
+            logger.warning("Failed to write trace: %s", e)
+
+    def traced(self, name: str):
+        """Start a trace for each update a handler gets; the handler runs with it as the current trace."""
+
+        def decorator(func):
+            @functools.wraps(func)
+            async def wrapper(update, *args, **kwargs):
+                trace = self.start(name, update_id=update.update_id)
+                if trace is None:
+                    return await func(update, *args, **kwargs)
+                token = _current.set(trace)
+                try:
+                    with trace.span("handler"):
+                        return await func(update, *args, **kwargs)
+                finally:
+                    _current.reset(token)
+                    trace.release()
+
+            return wrapper
+
+        return decorator
+
+    def _expire(self) -> None:
+        # Traces whose holders never came back (dropped reactions, viewers that never acked)
+        deadline = time.time() - self.timeout
+        while self._open:
+            trace = next(iter(self._open.values()))
+            if trace.started > deadline:
+                break
+            self.finish(trace, incomplete=True)
+
+
+def current() -> Trace | None:
+    return _current.get()
+
+
+@contextmanager
+def span(name: str, **attrs):
+    """Record a span on the current trace, if this update is being traced."""
+    trace = _current.get()
+    if trace is None:
+        yield attrs
+        return
+    with trace.span(name, **attrs) as record:
+        yield record
+
+
+@contextmanager
+def use(trace: Trace | None):
+    token = _current.set(trace)
+    try:
+        yield trace
+    finally:
+        _current.reset(token)
+
+
+def bind(name: str, call: Callable[[], Awaitable]) -> Callable[[], Awaitable]:
+    """Wrap a deferred call so it is recorded as a span on the current trace whenever it finally runs."""
+    trace = _current.get()
+    if trace is None:
+        return call
+    trace.hold()
+
+    async def traced_call():
+        # The outbox may call this again on retry, so only a success lets go of the trace
+        with trace.span(name):
+            result = await call()
+        trace.release()
+        return result
+
+    return traced_call
@@ -0,0 +1,141 @@
+import asyncio
+import json
+import logging
+import multiprocessing
+import os
+import shutil
+import subprocess
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+from PIL import Image, ImageOps
+
+logger = logging.getLogger(__name__)
+
+PHOTO_SUFFIXES = {".jpg", ".jpeg", ".png", ".webp"}
+FFMPEG_TIMEOUT = 300
+
+
+def process_file(path: str, width: int, height: int) -> str | None:
+    """Fit media into width x height; returns the new artifact path or None to keep the original."""
+    source = Path(path)
+    if source.suffix.lower() in PHOTO_SUFFIXES:
+        return _process_photo(source, width, height)
+    return _process_video(source, width, height)
+
+
+def _process_photo(source: Path, width: int, height: int) -> str | None:
+    with Image.open(source) as image:
+        image = ImageOps.exif_transpose(image)
+        if image.width <= width and image.height <= height and source.suffix.lower() in (".jpg", ".jpeg"):
+            return None
+        image.thumbnail((width, height), Image.Resampling.LANCZOS)
+        target = source.with_suffix(".jpg")
+        tmp_target = target.with_name(target.name + ".part")
+        try:
+            image.convert("RGB").save(tmp_target, "JPEG", quality=85, optimize=True)
+            os.replace(tmp_target, target)
+        finally:
+            tmp_target.unlink(missing_ok=True)
+    return str(target)
+
+
+def dhash_file(path: str, size: int = 8) -> int:
+    """64-bit difference hash: which neighbouring pixels get brighter, on a tiny grayscale copy."""
+    with Image.open(path) as image:
+        small = image.convert("L").resize((size + 1, size), Image.Resampling.LANCZOS)
+        pixels = list(small.getdata())
+    value = 0
+    for row in range(size):
+        for column in range(size):
+            left = pixels[row * (size + 1) + column]
+            right = pixels[row * (size + 1) + column + 1]
+            value = value << 1 | (left < right)
+    return value
+
+
+def _probe_video(source: Path) -> dict | None:
+    result = subprocess.run(
+        [
+            "ffprobe", "-v", "error", "-select_streams", "v:0",
+            "-show_entries", "stream=codec_name,width,height", "-of", "json", str(source),
+        ],
+        capture_output=True,
+        timeout=30,
+    )
+    streams = json.loads(result.stdout or "{}").get("streams") or []
+    return streams[0] if streams else None
+
+
+def _process_video(source: Path, width: int, height: int) -> str | None:
+    stream = _probe_video(source)
+    if stream is None:
+        return None
+
+    fits = stream.get("width", 0) <= width and stream.get("height", 0) <= height
+    if fits and stream.get("codec_name") == "h264":
+        # Already cheap to decode: only drop audio and move the index up front
+        codec_args = ["-c:v", "copy"]
+    else:
+        scale = (
+            f"scale='min(iw,{width})':'min(ih,{height})':force_original_aspect_ratio=decrease,"
+            "scale=trunc(iw/2)*2:trunc(ih/2)*2"
+        )
+        codec_args = [
+            "-vf", scale, "-c:v", "libx264", "-profile:v", "main", "-preset", "veryfast",
+            "-crf", "26", "-pix_fmt", "yuv420p",
+        ]
+
+    target = source.with_suffix(".mp4")
+    tmp_target = target.with_name(target.name + ".part")
+    try:
+        subprocess.run(
+            ["ffmpeg", "-y", "-v", "error", "-i", str(source), "-an", *codec_args, "-movflags", "+faststart",
+             "-f", "mp4", str(tmp_target)],
+            check=True,
+            capture_output=True,
+            timeout=FFMPEG_TIMEOUT,
+        )
+        os.replace(tmp_target, target)
+    finally:
+        tmp_target.unlink(missing_ok=True)
+    return str(target)
+
+
+class Transcoder:
+    """Runs process_file and dhash_file in a process pool so image work never blocks the event loop."""
+
+    def __init__(self, width: int, height: int, workers: int) -> None:
+        self.width = width
+        self.height = height
+        # Not fork: the server runs threads (resolver, PTB), and a child forked while one holds a lock can hang on it
+        self._pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("forkserver"))
+
+    async def __call__(self, path: Path) -> Path:
+        if path.suffix.lower() not in PHOTO_SUFFIXES and shutil.which("ffmpeg") is None:
+            return path
+        loop = asyncio.get_running_loop()
+        try:
+            result = await loop.run_in_executor(self._pool, process_file, str(path), self.width, self.height)
+        except Exception as e:
+            logger.warning("Failed to process %s, serving original: %s", path.name, e)
+            return path
+        if result is None:
+            return path
+
+        processed = Path(result)
+        if processed != path:
+            path.unlink(missing_ok=True)
+        logger.info("Processed %s -> %s", path.name, processed.name)
+        return processed
+
+    async def dhash(self, path: Path) -> int | None:
+        loop = asyncio.get_running_loop()
+        try:
+            return await loop.run_in_executor(self._pool, dhash_file, str(path))
+        except Exception as e:
+            logger.warning("Failed to hash %s: %s", path.name, e)
+            return None
+
+    def close(self) -> None:
+        self._pool.shutdown(cancel_futures=True)
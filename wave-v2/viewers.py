@@ -0,0 +1,93 @@
+import asyncio
+import logging
+import time
+
+from aiohttp import WSCloseCode, web
+
+from metrics import EVENTS_DROPPED, WS_SEND_FAILURES, WS_SEND_SECONDS
+
+logger = logging.getLogger(__name__)
+
+SEND_TIMEOUT = 10
+MAX_OVERFLOWS = 3
+
+
+def describe(data: dict) -> str:
+    for key in ("message", "command"):
+        if key in data:
+            return f"{key} {data[key]['type']} #{data.get('seq', '-')}"
+    return f"sync #{data.get('seq', '-')}"
+
+
+class Viewer:
+    """One WebSocket subscriber with its own bounded outbound queue and writer task."""
+
+    def __init__(self, ws: web.WebSocketResponse, name: str, queue_size: int) -> None:
+        self.ws = ws
+        self.name = name
+        # Room for at least the latest state plus the new message, which is what an overflow collapses to
+        self.queue: asyncio.Queue[dict] = asyncio.Queue(maxsize=max(queue_size, 2))
+        self.overflows = 0
+        self.task = asyncio.create_task(self._writer())
+        self.task.add_done_callback(lambda _: self._abandon())
+
+    def push(self, data: dict, latest: dict | None = None) -> bool:
+        """Enqueue without waiting; returns False when the viewer is too slow to keep."""
+        if self.task.done():
+            return False
+        try:
+            self.queue.put_nowait(data)
+            return True
+        except asyncio.QueueFull:
+            pass
+
+        self.overflows += 1
+        if self.overflows > MAX_OVERFLOWS:
+            return False
+        logger.info("Viewer %s is lagging, collapsing its queue to the latest state", self.name)
+        while not self.queue.empty():
+            self.queue.get_nowait()
+            self.queue.task_done()
+            EVENTS_DROPPED.inc(reason="viewer_overflow")
+        if latest is not None and latest is not data:
+            self.queue.put_nowait(latest)
+        self.queue.put_nowait(data)
+        return True
+
+    async def _writer(self) -> None:
+        while True:
+            data = await self.queue.get()
+            started = time.perf_counter()
+            try:
+                await asyncio.wait_for(self.ws.send_json(data), SEND_TIMEOUT)
+            except (ConnectionResetError, asyncio.TimeoutError, RuntimeError) as e:
+                WS_SEND_FAILURES.inc()
+                logger.info("Viewer %s send failed (%s), closing", self.name, e.__class__.__name__)
+                break
+            finally:
+                self.queue.task_done()
+            WS_SEND_SECONDS.observe(time.perf_counter() - started)
+            logger.debug("Sent %s to viewer %s", describe(data), self.name)
+        await self.ws.close()
+
+    def _abandon(self) -> None:
+        # The writer is gone and push() refuses new data, so nothing will send what is left; don't keep drain() waiting
+        while not self.queue.empty():
+            self.queue.get_nowait()
+            self.queue.task_done()
+
+    async def drain(self, timeout: float) -> bool:
+        """Wait until everything queued so far has been written; False if that took too long."""
+        try:
+            await asyncio.wait_for(self.queue.join(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    async def close(self, code: int = WSCloseCode.OK, message: bytes = b"") -> None:
+        self.task.cancel()
+        try:
+            await self.task
+        except asyncio.CancelledError:
+            pass
+        await self.ws.close(code=code, message=message)